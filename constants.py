@@ -1,19 +1,19 @@
 import json
 import os
+from pathlib import Path
 import re
-import time
-import numpy as np
 import pandas as pd
-import requests
 from tqdm.auto import tqdm
 from user_agent import generate_user_agent
+from data_ops import (download_master_indexes, get_filings_bulk, sec_session,
+                      sheet_resolver, ticker_index)
+from forecast import forecast_columns, forecast_frame
 
 # prerequisites for requests
-s = requests.Session()
+s = sec_session()
 random_ua = generate_user_agent()
 
-heads = {'Host': 'www.sec.gov', 'Connection': 'close',
-         'Accept': 'application/json, text/javascript, */*; q=0.01', 'X-Requested-With': 'XMLHttpRequest',
+heads = {'Accept': 'application/json, text/javascript, */*; q=0.01', 'X-Requested-With': 'XMLHttpRequest',
          'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.163 Safari/537.36',
          }
 
@@ -51,52 +51,17 @@ def save_json(df):
 def get_cik_json(ticker):
     """retrieves company's CIK from default filepath"""
 
-    with open(filepath) as f:
-        data = json.load(f)
-
-    for info in data.values():
-        if info['ticker'] == ticker.upper():
-            cik = info['cik_str']
-
-            return cik
+    return ticker_index(filepath).cik(ticker)
 
 
 def get_exchange(ticker):
     """retrieves company's exchange from default filepath"""
 
-    with open(filepath) as f:
-        f = json.load(f)
-
-        for key, value in f.items():
-            if value['ticker'] == ticker.upper():
-                exchange = value['exchange']
-
-                return exchange
+    return ticker_index(filepath).exchange(ticker)
 
 
 def download_master_index(year):
-    qtr = 1
-    while qtr < 5:
-        try:
-            url = f"https://www.sec.gov/Archives/edgar/full-index/{year}/QTR{qtr}/master.idx"
-            response = requests.get(url, headers=heads)
-            response.raise_for_status()
-
-            down_direct = os.getcwd() + '/data/edgar_master_index'
-
-            filename = f'/master{year}QTR{qtr}.idx'
-            path = ''.join([down_direct, filename])
-
-            if not os.path.exists(path):
-                print(url)
-                with open(path, 'wb') as f:
-                    f.write()
-
-            qtr += 1
-            time.sleep(7.5)
-
-        except Exception:
-            continue
+    return download_master_indexes(year, session=s)
 
 
 def get_filings(ticker, form='10-K'):
@@ -104,34 +69,8 @@ def get_filings(ticker, form='10-K'):
     these endpoints are used to download excel files of company financials
     provided by the SEC"""
 
-    cik = get_cik_json(ticker)
-    master_index = ''.join([os.getcwd(), '/data/edgar_master_index/'])
-
-    directory = os.listdir(master_index)
-
-    pattern = f'({form}).\d+.\d+.\d+.(edgar/data/{cik}/)(\d+.\d+.\d+)'
-
-    downloads = []
-
-    i = 0
-    while i < 5:
-
-        for file in directory:
-            doc = master_index + file
-
-            with open(doc, encoding='utf-8') as f:
-                try:
-                    regex = re.findall(pattern, f.read())
-
-                    for item in regex:
-                        downloads.append(item)
-
-                except UnicodeDecodeError:
-                    print(f'Failed to decode: {file}')
-                    continue
-        i += 1
-
-    return downloads
+    return [(form_type, domain, accession) for form_type, _, domain, accession
+            in get_filings_bulk([ticker], form=form)[ticker]]
 
 
 def download_files(ticker, form='10-K'):
@@ -142,8 +81,8 @@ def download_files(ticker, form='10-K'):
     accession = [filename[-1] for filename in filenames]
     domain = [filename[-2] for filename in filenames]
 
-    formatted_accession = [accession.pop().replace('-', '') for _ in
-                           accession]
+    formatted_accession = [number.replace('-', '') for number in
+                           reversed(accession)]
 
     formatted = [''.join([domain[0], number]) for number in formatted_accession]
 
@@ -165,9 +104,9 @@ def download_files(ticker, form='10-K'):
             i += 1
 
         try:
-            url = f'https://www.sec.gov/Archives/{name}/Financial_Report.xlsx'
+            url = f'/Archives/{name}/Financial_Report.xlsx'
 
-            req = requests.get(url, headers=heads, stream=True)
+            req = s.get(url, headers=heads, stream=True)
 
             if req.status_code == 200:
                 with open(path, 'wb') as f:
@@ -362,16 +301,7 @@ def retrieve_cash_flow_statements(ticker):
 
 
 def add_columns(df, periods=5):
-    df = df.copy()
-
-    year = int(df.columns[-1])
-    first_period = year + 1
-    last_period = first_period + periods
-
-    new_cols = list(range(first_period, last_period))
-    unpacked = [*list(df.columns), *new_cols]
-
-    return unpacked
+    return forecast_columns(list(df.columns), periods)
 
 
 def excel_exception_helper(ticker):
@@ -392,19 +322,14 @@ def excel_exception_helper(ticker):
 def statement_regex(ticker, statement='income'):
     excel = excel_exception_helper(ticker)
 
-    if statement.lower() == 'income':
-        r = re.compile('^.*.Inco*.$')
-
-    elif statement.lower() == 'balance':
-        r = re.compile('^.*.Balance*.$')
-
-    elif statement.lower() == 'cash flow':
-        r = re.compile('^.*.Cash*.$')
+    if statement.lower() == 'cash flow':
+        statement = 'cash'
 
     for i in excel:
-        sheet_name = list(filter(r.match, i.sheet_names)).pop()
+        sheets = sheet_resolver().resolve(i.sheet_names, filer=ticker.upper(),
+                                          statements=[statement.lower()])
 
-        return sheet_name
+        return sheets.get(statement.lower())
 
 
 def revenue_growth_rate(df):
@@ -418,38 +343,4 @@ def revenue_growth_rate(df):
 
 
 def forecast_accounts(df, periods=5):
-    growth_rate = revenue_growth_rate(df)
-    factor = (1 + growth_rate)
-
-    df = df.copy()
-
-    new_df = pd.DataFrame(columns=add_columns(df))
-
-    i = 1
-    while i < len(df.index):
-        row_name = df.iloc[i].name
-        j = 1
-        arrays = []
-        array = df.iloc[i].to_numpy()
-
-        while j < periods + 1:
-
-            if j == 1:
-                array = np.append(array, np.ceil(array[-1] * factor))
-                arrays.append(array)
-
-            else:
-                array = np.append(array, np.ceil(arrays[-1][-1] * factor))
-                arrays.append(array)
-
-            j += 1
-
-        series = pd.Series(arrays[-1]).rename(row_name)
-        temporary_df = pd.DataFrame(series).swapaxes('index', 'columns')
-        temporary_df.columns = add_columns(df)
-
-        new_df.loc[row_name] = temporary_df.iloc[0]
-
-        i += 1
-
-    return new_df
\ No newline at end of file
+    return forecast_frame(df, revenue_growth_rate(df), periods=periods)
@@ -1,14 +1,2016 @@
+import bisect
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import datetime as dt
+from functools import cached_property, lru_cache
+import io
+from email.utils import format_datetime, parsedate_to_datetime
 import json
 import os
 from pathlib import Path
 import re
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import NamedTuple
+from urllib.parse import quote
+import numpy as np
 import pandas as pd
-import requests
-from ratelimit import limits
-from tqdm.auto import tqdm
-import sqlalchemy as db
-from sqlalchemy_utils import database_exists, create_database
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+def _progress(*args, **kwargs):
+    """tqdm progress bar, tqdm is imported on first use"""
+
+    from tqdm.auto import tqdm
+
+    return tqdm(*args, **kwargs)
+
+
+def __getattr__(name):
+    # SECSession subclasses requests.Session, it lives in sec_http so that
+    # importing this module does not import requests
+    if name == 'SECSession':
+        from sec_http import SECSession
+        return SECSession
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+class TickerIndex:
+    """lookup tables over company_tickers.json, parsed once and rebuilt only
+    when the file's mtime changes"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._by_ticker = {}
+        self._by_cik = {}
+        self._titles = []
+        self._title_tickers = []
+
+
+    def _refresh(self):
+        """(re)builds the lookup tables if the file changed since last build"""
+
+        mtime = os.path.getmtime(self.filepath)
+        if mtime == self._mtime:
+            return
+
+        with self._lock:
+            if mtime == self._mtime:
+                return
+
+            with open(self.filepath) as f:
+                data = json.load(f)
+
+            by_ticker = {}
+            by_cik = {}
+            for info in data.values():
+                by_ticker.setdefault(info['ticker'].upper(), info)
+                by_cik.setdefault(int(info['cik_str']), info)
+
+            titles = sorted((info['title'].upper(), info['ticker'])
+                            for info in by_ticker.values())
+
+            self._by_ticker = by_ticker
+            self._by_cik = by_cik
+            self._titles = [title for title, _ in titles]
+            self._title_tickers = [ticker for _, ticker in titles]
+            self._mtime = mtime
+
+
+    def get(self, ticker):
+        """returns the company_tickers.json entry for a ticker, or None"""
+
+        self._refresh()
+        return self._by_ticker.get(ticker.upper())
+
+
+    def cik(self, ticker):
+        info = self.get(ticker)
+        return info['cik_str'] if info else None
+
+
+    def exchange(self, ticker):
+        info = self.get(ticker)
+        return info.get('exchange') if info else None
+
+
+    def by_cik(self, cik):
+        """returns the entry for a CIK, or None"""
+
+        self._refresh()
+        return self._by_cik.get(int(cik))
+
+
+    def search_title(self, prefix):
+        """returns entries whose company title starts with prefix
+        (case-insensitive)"""
+
+        self._refresh()
+        prefix = prefix.upper()
+        lo = bisect.bisect_left(self._titles, prefix)
+        hi = bisect.bisect_right(self._titles, prefix + '\uffff')
+
+        return [self._by_ticker[t.upper()] for t in self._title_tickers[lo:hi]]
+
+
+    def bulk(self, tickers):
+        """returns {ticker: entry} for a list of tickers, entry is None for
+        tickers that are not in the file"""
+
+        self._refresh()
+        return {ticker: self._by_ticker.get(ticker.upper())
+                for ticker in tickers}
+
+
+_ticker_indexes = {}
+_ticker_indexes_lock = threading.Lock()
+
+
+def ticker_index(filepath=None):
+    """returns the process-wide TickerIndex for filepath (defaults to
+    data/company_tickers.json)"""
+
+    if filepath is None:
+        filepath = str(Path(''.join([os.getcwd(), '/data/company_tickers.json'])))
+
+    with _ticker_indexes_lock:
+        index = _ticker_indexes.get(filepath)
+        if index is None:
+            index = _ticker_indexes[filepath] = TickerIndex(filepath)
+
+    return index
+
+
+class Filing(NamedTuple):
+    """one record of an EDGAR master.idx file"""
+
+    cik: int
+    company: str
+    form: str
+    date_filed: dt.date
+    filename: str
+
+
+def _decode(line):
+    try:
+        return line.decode('utf-8')
+
+    except UnicodeDecodeError:
+        return line.decode('latin-1')
+
+
+def _parse_filing(line):
+    parts = _decode(line).rstrip('\r\n').split('|')
+    if len(parts) != 5 or not parts[0].isdigit():
+        return None
+
+    cik, company, form, date_filed, filename = parts
+    try:
+        date_filed = dt.date.fromisoformat(date_filed)
+
+    except ValueError:
+        return None
+
+    return Filing(int(cik), company, form, date_filed, filename)
+
+
+def iter_master_index(path):
+    """streams Filing records from a master.idx file line by line, so memory
+    stays flat regardless of file size. the header block is skipped and lines
+    that are not valid utf-8 are decoded as latin-1 instead of failing the
+    whole file"""
+
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.startswith(b'---'):
+                break
+
+            filing = _parse_filing(line)
+            if filing is not None:
+                yield filing
+
+        for line in f:
+            filing = _parse_filing(line)
+            if filing is not None:
+                yield filing
+
+
+def _iter_master_index_rows(path):
+    for cik, company, form, date_filed, filename in iter_master_index(path):
+        yield cik, company, form, date_filed.isoformat(), filename
+
+
+def _read_master_index(path):
+    """process pool worker, parses one quarter file into row tuples"""
+
+    return list(_iter_master_index_rows(path))
+
+
+class MasterIndexStore:
+    """SQLite table of the EDGAR master.idx files in data/edgar_master_index,
+    indexed on (cik, form, date_filed). each quarter file is ingested once,
+    files that are new or changed since the last sync are picked up
+    incrementally"""
+
+    def __init__(self, directory=None, db_path=None):
+        if directory is None:
+            directory = str(Path(''.join([os.getcwd(), '/data/edgar_master_index'])))
+
+        if db_path is None:
+            db_path = str(Path(''.join([os.getcwd(), '/data/edgar_master_index.sqlite'])))
+
+        self.directory = directory
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS filings (
+                cik INTEGER NOT NULL,
+                company TEXT,
+                form TEXT NOT NULL,
+                date_filed TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                source TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS filings_cik_form_date
+                ON filings (cik, form, date_filed);
+            CREATE INDEX IF NOT EXISTS filings_source ON filings (source);
+            CREATE TABLE IF NOT EXISTS ingested (
+                source TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                rows INTEGER NOT NULL
+            );
+            """
+        )
+
+
+    def _ingest(self, source, rows, stat):
+        with self.conn:
+            self.conn.execute('DELETE FROM filings WHERE source = ?', (source,))
+            cursor = self.conn.executemany(
+                'INSERT INTO filings VALUES (?, ?, ?, ?, ?, ?)',
+                (row + (source,) for row in rows))
+            self.conn.execute(
+                'INSERT OR REPLACE INTO ingested VALUES (?, ?, ?, ?)',
+                (source, stat.st_mtime, stat.st_size, cursor.rowcount))
+
+
+    def sync(self, workers=None):
+        """ingests quarter files that are new or changed on disk, drops rows
+        of files that were removed. returns the names of ingested files
+
+        when several files are pending they are parsed on a process pool of
+        `workers` processes (defaults to the cpu count) and merged into the
+        table as each finishes, workers=1 parses in this process"""
+
+        if not os.path.exists(self.directory):
+            return []
+
+        with self._lock:
+            known = {source: (mtime, size) for source, mtime, size in
+                     self.conn.execute('SELECT source, mtime, size FROM ingested')}
+
+            pending = {}
+            files = sorted(os.listdir(self.directory))
+            for file in files:
+                if file.endswith('.part'):
+                    continue
+
+                path = str(Path(''.join([self.directory, '/', file])))
+                stat = os.stat(path)
+
+                if known.get(file) != (stat.st_mtime, stat.st_size):
+                    pending[file] = (path, stat)
+
+            if workers is None:
+                workers = os.cpu_count() or 1
+            workers = min(workers, len(pending))
+
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = {executor.submit(_read_master_index, path): file
+                               for file, (path, _) in pending.items()}
+
+                    pbar = _progress(total=len(futures))
+                    pbar.set_description('Ingesting master index')
+                    for future in as_completed(futures):
+                        file = futures[future]
+                        self._ingest(file, future.result(), pending[file][1])
+                        pbar.update(1)
+                    pbar.close()
+
+            else:
+                for file, (path, stat) in pending.items():
+                    self._ingest(file, _iter_master_index_rows(path), stat)
+
+            removed = set(known) - set(files)
+            with self.conn:
+                for file in removed:
+                    self.conn.execute('DELETE FROM filings WHERE source = ?', (file,))
+                    self.conn.execute('DELETE FROM ingested WHERE source = ?', (file,))
+
+        return sorted(pending)
+
+
+    def query(self, cik, form='10-K'):
+        """returns (form, date_filed, filename) of a company's filings,
+        ordered by date filed"""
+
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT DISTINCT form, date_filed, filename FROM filings '
+                'WHERE cik = ? AND form = ? ORDER BY date_filed',
+                (int(cik), form)).fetchall()
+
+        return rows
+
+
+    def filings(self, ciks=None, forms=None):
+        """returns the filings of many companies and form types from one pass
+        over the table as a DataFrame ordered by cik and date filed. ciks and
+        forms default to all"""
+
+        clauses = []
+        params = []
+        if forms is not None:
+            forms = list(forms)
+            clauses.append(f'form IN ({", ".join("?" * len(forms))})')
+            params.extend(forms)
+
+        query = 'SELECT DISTINCT cik, company, form, date_filed, filename FROM filings'
+
+        if ciks is None:
+            chunks = [None]
+        else:
+            ciks = sorted({int(cik) for cik in ciks})
+            chunks = [ciks[i:i + 500] for i in range(0, len(ciks), 500)]
+
+        frames = []
+        with self._lock:
+            for chunk in chunks:
+                where = list(clauses)
+                args = list(params)
+                if chunk is not None:
+                    where.append(f'cik IN ({", ".join("?" * len(chunk))})')
+                    args.extend(chunk)
+
+                sql = query
+                if where:
+                    sql = ' '.join([sql, 'WHERE', ' AND '.join(where)])
+
+                frames.append(pd.read_sql_query(sql, self.conn, params=args))
+
+        df = pd.concat(frames, ignore_index=True)
+
+        return df.sort_values(['cik', 'date_filed'], ignore_index=True)
+
+
+    def close(self):
+        self.conn.close()
+
+
+_master_index_stores = {}
+_master_index_stores_lock = threading.Lock()
+
+
+def master_index_store(directory=None, db_path=None):
+    """returns the process-wide MasterIndexStore for db_path"""
+
+    key = (directory, db_path)
+    with _master_index_stores_lock:
+        store = _master_index_stores.get(key)
+        if store is None:
+            store = _master_index_stores[key] = MasterIndexStore(directory, db_path)
+
+    return store
+
+
+def get_filings_bulk(tickers, form='10-K', workers=None):
+    """looks up the filings of many tickers with one sync of the master index
+    store and one query. returns {ticker: [(form, date filed, domain,
+    accession), ...]} in the shape of DataSEC.get_filings"""
+
+    store = master_index_store()
+    store.sync(workers=workers)
+
+    ciks = {ticker: info['cik_str']
+            for ticker, info in ticker_index().bulk(tickers).items() if info}
+
+    df = store.filings(ciks=ciks.values(), forms=[form])
+    grouped = {cik: group for cik, group in df.groupby('cik')}
+
+    downloads = {}
+    for ticker in tickers:
+        cik = ciks.get(ticker)
+        domain = f'edgar/data/{cik}/'
+
+        group = grouped.get(cik)
+        if group is None:
+            downloads[ticker] = []
+            continue
+
+        downloads[ticker] = [
+            (form_type, date_filed, domain, filename[len(domain):].rsplit('.', 1)[0])
+            for form_type, date_filed, filename
+            in zip(group['form'], group['date_filed'], group['filename'])]
+
+    return downloads
+
+
+SEC_HEADERS = {'Accept': 'application/json, text/javascript, */*; q=0.01',
+               'X-Requested-With': 'XMLHttpRequest',
+               'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.163 Safari/537.36',
+               }
+
+
+class RateLimiter:
+    """blocking token bucket, `rate` requests per `per` seconds with bursts
+    of up to `burst`. callers reserve a token and sleep off any deficit, so
+    throughput stays at exactly the allowed rate
+
+    with a path the bucket's state lives in that file behind an os file lock,
+    which makes one budget shared by every thread, asyncio task and process
+    using the same path. without one it is shared within this process only"""
+
+    def __init__(self, rate=10, per=1.0, burst=None, path=None):
+        self.rate = rate / per
+        self.burst = rate if burst is None else burst
+        self.path = path
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._last = time.time()
+
+        if path is not None and not os.path.exists(path):
+            with open(path, 'a'):
+                pass
+
+
+    def _refill(self, tokens, last, now):
+        tokens = min(self.burst, tokens + (now - last) * self.rate) - 1
+
+        return tokens, max(0.0, -tokens / self.rate)
+
+
+    def _reserve_file(self):
+        with open(self.path, 'r+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+            try:
+                now = time.time()
+                try:
+                    tokens, last = (float(x) for x in f.read().split())
+
+                except ValueError:
+                    tokens, last = float(self.burst), now
+
+                tokens, wait = self._refill(tokens, last, now)
+
+                f.seek(0)
+                f.truncate()
+                f.write(f'{tokens} {now}')
+                f.flush()
+
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+        return wait
+
+
+    def reserve(self):
+        """takes a token, returns how long the caller has to wait before
+        using it"""
+
+        with self._lock:
+            if self.path is not None:
+                return self._reserve_file()
+
+            now = time.time()
+            self._tokens, wait = self._refill(self._tokens, self._last, now)
+            self._last = now
+
+        return wait
+
+
+    def acquire(self):
+        """blocks until a request may be sent"""
+
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+    async def acquire_async(self):
+        """waits without blocking the event loop until a request may be sent"""
+
+        import asyncio
+
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+_sec_rate_limiter = None
+_sec_rate_limiter_lock = threading.Lock()
+
+
+def sec_rate_limiter():
+    """returns the rate limiter shared by all SEC requests. its state is kept
+    in SEC_RATE_LIMIT_FILE (defaults to a file in the temp directory) so
+    worker processes draw from the same 10 requests/second budget"""
+
+    global _sec_rate_limiter
+
+    with _sec_rate_limiter_lock:
+        if _sec_rate_limiter is None:
+            path = os.environ.get('SEC_RATE_LIMIT_FILE', str(
+                Path(''.join([tempfile.gettempdir(), '/pyib_sec_rate_limit']))))
+            # no burst allowance, a full bucket would let 10 requests through
+            # at once and 10 more within the same second
+            _sec_rate_limiter = RateLimiter(rate=10, per=1.0, burst=1, path=path)
+
+    return _sec_rate_limiter
+
+
+_sec_session = None
+_sec_session_lock = threading.Lock()
+
+
+def sec_session():
+    """returns the process-wide SECSession, created on first use"""
+
+    global _sec_session
+
+    with _sec_session_lock:
+        if _sec_session is None:
+            from sec_http import SECSession
+            _sec_session = SECSession()
+
+    return _sec_session
+
+
+def set_sec_session(session):
+    """replaces the process-wide session, e.g. with one configured for a
+    different pool size or pointed at a local server"""
+
+    global _sec_session
+
+    with _sec_session_lock:
+        _sec_session = session
+
+
+def _current_quarter():
+    today = dt.date.today()
+    return today.year, (today.month - 1) // 3 + 1
+
+
+def _quarters(start_year, end_year):
+    """(year, quarter) pairs from start_year to end_year, leaving out quarters
+    that have not started yet"""
+
+    current = _current_quarter()
+
+    return [(year, qtr) for year in range(start_year, end_year + 1)
+            for qtr in range(1, 5) if (year, qtr) <= current]
+
+
+def _write_atomic(path, content):
+    """writes to a temporary file next to path and renames it into place, so
+    an interrupted download never leaves a truncated file behind"""
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def download_master_indexes(start_year, end_year=None, directory=None,
+                            session=None, revalidate=False, workers=4):
+    """downloads EDGAR master.idx files for every quarter from start_year to
+    end_year into directory as master{year}QTR{qtr}.txt
+
+    quarters already on disk are skipped, or with revalidate=True re-requested
+    with If-None-Match/If-Modified-Since so only changed files come back. the
+    current quarter is still being appended to by the SEC and is always
+    revalidated. missing quarters are fetched on `workers` threads within the
+    SEC rate limit. returns {(year, qtr): status} where status is one of
+    'downloaded', 'unchanged', 'skipped' or the error message"""
+
+    import requests
+
+    if end_year is None:
+        end_year = start_year
+
+    if directory is None:
+        directory = str(Path(''.join([os.getcwd(), '/data/edgar_master_index'])))
+
+    if session is None:
+        session = sec_session()
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    etags_path = str(Path(''.join([directory, '_etags.json'])))
+    try:
+        with open(etags_path) as f:
+            etags = json.load(f)
+
+    except (FileNotFoundError, ValueError):
+        etags = {}
+
+    current = _current_quarter()
+
+    def fetch(year, qtr):
+        filename = f'master{year}QTR{qtr}.txt'
+        path = str(Path(''.join([directory, '/', filename])))
+        url = f'/Archives/edgar/full-index/{year}/QTR{qtr}/master.idx'
+
+        request_headers = {}
+        if os.path.exists(path):
+            if not revalidate and (year, qtr) != current:
+                return 'skipped'
+
+            modified = dt.datetime.fromtimestamp(os.path.getmtime(path), dt.timezone.utc)
+            request_headers['If-Modified-Since'] = format_datetime(modified, usegmt=True)
+            if filename in etags:
+                request_headers['If-None-Match'] = etags[filename]
+
+        try:
+            response = session.get(url, headers=request_headers)
+            if response.status_code == 304:
+                return 'unchanged'
+            response.raise_for_status()
+
+        except requests.RequestException as e:
+            return str(e)
+
+        _write_atomic(path, response.content)
+
+        last_modified = response.headers.get('Last-Modified')
+        if last_modified:
+            mtime = parsedate_to_datetime(last_modified).timestamp()
+            os.utime(path, (mtime, mtime))
+
+        etag = response.headers.get('ETag')
+        if etag:
+            etags[filename] = etag
+
+        return 'downloaded'
+
+    quarters = _quarters(start_year, end_year)
+
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, year, qtr): (year, qtr)
+                   for year, qtr in quarters}
+
+        pbar = _progress(total=len(futures))
+        pbar.set_description('Downloading master index')
+        for future in as_completed(futures):
+            statuses[futures[future]] = future.result()
+            pbar.update(1)
+        pbar.close()
+
+    _write_atomic(etags_path, json.dumps(etags).encode())
+
+    return dict(sorted(statuses.items()))
+
+
+STATEMENT_TITLES = {
+    'income': [
+        'consolidated statements of income',
+        'consolidated statement of income',
+        'consolidated statements of operations',
+        'consolidated statement of operations',
+        'consolidated statements of earnings',
+        'consolidated statement of earnings',
+        'consolidated income statements',
+        'consolidated income statement',
+        'statements of income',
+        'statements of operations',
+        'consolidated statements of income and comprehensive income',
+        'consolidated statements of operations and comprehensive income',
+        'consolidated statements of comprehensive income',
+        'consolidated statement of comprehensive income',
+    ],
+    'balance': [
+        'consolidated balance sheets',
+        'consolidated balance sheet',
+        'consolidated statements of financial position',
+        'consolidated statement of financial position',
+        'consolidated statements of financial condition',
+        'consolidated statement of financial condition',
+        'balance sheets',
+        'balance sheet',
+    ],
+    'cash': [
+        'consolidated statements of cash flows',
+        'consolidated statement of cash flows',
+        'consolidated cash flow statements',
+        'consolidated cash flows statements',
+        'statements of cash flows',
+        'statement of cash flows',
+    ],
+}
+
+# excel caps sheet names at 31 characters, names at least this long may be
+# cut off part way through a title
+TRUNCATED_LENGTH = 28
+
+
+def _normalize_sheet_name(name):
+    return ' '.join(name.replace('_', ' ').lower().split())
+
+
+@lru_cache(maxsize=4096)
+def classify_sheet(name):
+    """returns (statement, rank) for a sheet name, or None. rank is the
+    position of the matched title in STATEMENT_TITLES, lower is better.
+    matching ignores case, underscores vs spaces and truncation"""
+
+    if 'parenthetical' in name.lower():
+        return None
+
+    normalized = _normalize_sheet_name(name)
+    truncated = len(name) >= TRUNCATED_LENGTH
+
+    best = None
+    for statement, titles in STATEMENT_TITLES.items():
+        for rank, title in enumerate(titles):
+            if normalized.startswith(title) or (truncated and title.startswith(normalized)):
+                if best is None or rank < best[1]:
+                    best = (statement, rank)
+                break
+
+    return best
+
+
+class SheetResolver:
+    """picks the income, balance and cash sheets of a workbook from its sheet
+    names alone. decisions are cached per filer, a later filing from the same
+    company whose workbook has the same sheet name resolves without
+    classifying anything"""
+
+    def __init__(self):
+        self._filers = {}
+        self._lock = threading.Lock()
+
+
+    def resolve(self, sheet_names, filer=None, statements=None):
+        """returns {statement: sheet name} for the statements found"""
+
+        if statements is None:
+            statements = list(STATEMENT_TITLES)
+
+        with self._lock:
+            cached = dict(self._filers.get(filer, {}))
+
+        resolved = {statement: cached[statement] for statement in statements
+                    if cached.get(statement) in sheet_names}
+
+        missing = [statement for statement in statements if statement not in resolved]
+        if missing:
+            best = {}
+            for name in sheet_names:
+                match = classify_sheet(name)
+                if match is None:
+                    continue
+
+                statement, rank = match
+                if statement in missing and (statement not in best or rank < best[statement][1]):
+                    best[statement] = (name, rank)
+
+            for statement, (name, _) in best.items():
+                resolved[statement] = name
+
+            if filer is not None and best:
+                with self._lock:
+                    self._filers.setdefault(filer, {}).update(
+                        {statement: name for statement, (name, _) in best.items()})
+
+        return resolved
+
+
+    def clear(self, filer=None):
+        with self._lock:
+            if filer is None:
+                self._filers.clear()
+            else:
+                self._filers.pop(filer, None)
+
+
+_sheet_resolver = SheetResolver()
+
+
+def sheet_resolver():
+    """returns the process-wide SheetResolver"""
+
+    return _sheet_resolver
+
+
+STATEMENT_FOLDERS = {
+    'income': 'income_statements',
+    'balance': 'balance_sheets',
+    'cash': 'cash_flow_statements',
+}
+
+
+class Report(NamedTuple):
+    """the parts of a Financial_Report.xlsx used by the pipeline, sheets maps
+    each statement to the sheet it was read from"""
+
+    sheet_names: list
+    year_ended: str
+    sheets: dict
+    statements: dict
+
+
+def _worksheet(wb, name):
+    """a sheet of a read-only workbook with its dimensions reset, like
+    pd.read_excel does, so a stale <dimension> tag (e.g. ref="A1") does not
+    cut the sheet short"""
+
+    ws = wb[name]
+    ws.reset_dimensions()
+
+    return ws
+
+
+def _sheet_frame(ws):
+    """reads a worksheet into a DataFrame the way pd.read_excel does, first
+    row as header"""
+
+    rows = [list(row) for row in ws.iter_rows(values_only=True)]
+    while rows and all(value is None for value in rows[-1]):
+        rows.pop()
+
+    if not rows:
+        return pd.DataFrame()
+
+    width = max(len(row) for row in rows)
+    rows = [row + [None] * (width - len(row)) for row in rows]
+
+    header = []
+    seen = {}
+    for i, name in enumerate(rows[0]):
+        name = f'Unnamed: {i}' if name is None else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        header.append(name)
+
+    return pd.DataFrame(rows[1:], columns=header)
+
+
+def _year_ended(ws):
+    """four digit years in the first data row of the cover sheet, the way
+    DataSEC.get_year finds them"""
+
+    rows = ws.iter_rows(min_row=1, max_row=2, values_only=True)
+    header = next(rows, ())
+    first = next(rows, ())
+
+    text = ' '.join(f'{label} {value}' for label, value in zip(header, first))
+
+    return re.findall(r'\d{4}', text)
+
+
+def read_report(content, statements=None, filer=None):
+    """parses a Financial_Report.xlsx from memory in one read-only open:
+    lists its sheets, finds the fiscal year on the cover sheet and extracts
+    the requested statements (all three by default) from the sheets the
+    resolver picks for filer. statements without a sheet are left out"""
+
+    if statements is None:
+        statements = list(STATEMENT_TITLES)
+
+    from openpyxl import load_workbook
+
+    wb = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        sheet_names = list(wb.sheetnames)
+        years = _year_ended(_worksheet(wb, sheet_names[0])) if sheet_names else []
+
+        sheets = sheet_resolver().resolve(sheet_names, filer=filer,
+                                          statements=statements)
+        frames = {statement: _sheet_frame(_worksheet(wb, name))
+                  for statement, name in sheets.items()}
+
+    finally:
+        wb.close()
+
+    return Report(sheet_names, years[0] if years else None, sheets, frames)
+
+
+def statement_rows(df):
+    """converts a statement sheet, as read by read_report or from its csv,
+    into long rows of (account, occurrence, line, period, period_label, value).
+    period is the four digit year of each value column, occurrence numbers
+    repeated account labels within the sheet and line keeps the row order"""
+
+    if df.empty or len(df.columns) < 2:
+        return pd.DataFrame(columns=['account', 'occurrence', 'line', 'period',
+                                     'period_label', 'value'])
+
+    # income and cash flow sheets put the period ends on the first row under a
+    # '12 Months Ended' header, balance sheets have them in the header itself
+    first = [value if isinstance(value, str) else None for value in df.iloc[0, 1:]]
+    date_row = any(value and re.search(r'\d{4}', value) for value in first)
+
+    columns = {}
+    for name, value in zip(df.columns[1:], first):
+        label = value if date_row else str(name)
+        year = re.search(r'\d{4}', label or '')
+        if year and int(year.group()) not in {period for period, _ in columns.values()}:
+            columns[name] = (int(year.group()), label)
+
+    body = df.iloc[1:] if date_row else df
+    accounts = body.iloc[:, 0].fillna('').astype(str).reset_index(drop=True)
+    values = body[list(columns)].apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64')
+
+    rows, cols = values.shape
+    periods = [period for period, _ in columns.values()]
+    labels = [label for _, label in columns.values()]
+
+    return pd.DataFrame({
+        'account': pd.Categorical(np.repeat(accounts.to_numpy(), cols)),
+        'occurrence': np.repeat(accounts.groupby(accounts).cumcount().to_numpy(), cols).astype('int16'),
+        'line': np.repeat(np.arange(rows), cols).astype('int32'),
+        'period': np.tile(periods, rows).astype('int16'),
+        'period_label': pd.Categorical(np.tile(labels, rows)),
+        'value': values.reshape(-1),
+    })
+
+
+class StatementStore:
+    """columnar parquet store of statement values, hive partitioned as
+    ticker=/statement=/form=/fiscal_year=/ under data/statements (form is
+    url-quoted, e.g. form=10-K%2FA). each filing's statement is one small
+    file of long rows with a categorical account column and typed numeric
+    columns, reads push ticker/statement/form/year filters and column
+    selection down to the files"""
+
+    def __init__(self, root=None):
+        if root is None:
+            root = str(Path(''.join([os.getcwd(), '/data/statements'])))
+
+        self.root = root
+
+
+    def _path(self, ticker, statement, form, fiscal_year):
+        return str(Path(''.join([self.root, f'/ticker={ticker.upper()}/statement={statement}/'
+                                            f'form={quote(form, safe="")}/'
+                                            f'fiscal_year={int(fiscal_year)}/part-0.parquet'])))
+
+
+    def write(self, ticker, statement, fiscal_year, df, form='10-K', accession=None):
+        """stores a statement sheet (see statement_rows) as the form's
+        statement of fiscal_year, replacing what was stored for it before"""
+
+        rows = statement_rows(df)
+        rows['accession'] = pd.Series([accession] * len(rows), dtype='string')
+
+        path = self._path(ticker, statement, form, fiscal_year)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # dot files are skipped by dataset reads, so an unfinished write is
+        # never read as a partition file
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.', suffix='.part')
+        os.close(fd)
+        try:
+            rows.to_parquet(tmp, engine='pyarrow', index=False)
+            os.replace(tmp, path)
+
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        return len(rows)
+
+
+    def read(self, tickers=None, statements=None, years=None, columns=None, forms=None):
+        """reads stored rows, optionally only of the given tickers, statements,
+        fiscal years and forms and only the given columns"""
+
+        if any(values is not None and len(values) == 0
+               for values in (tickers, statements, years, forms)):
+            return pd.DataFrame(columns=columns or [])
+
+        filters = []
+        if tickers is not None:
+            filters.append(('ticker', 'in', [ticker.upper() for ticker in tickers]))
+        if statements is not None:
+            filters.append(('statement', 'in', list(statements)))
+        if years is not None:
+            filters.append(('fiscal_year', 'in', [int(year) for year in years]))
+        if forms is not None:
+            filters.append(('form', 'in', list(forms)))
+
+        if not os.path.exists(self.root) or not os.listdir(self.root):
+            return pd.DataFrame(columns=columns or [])
+
+        return pd.read_parquet(self.root, engine='pyarrow', columns=columns,
+                               filters=filters or None)
+
+
+    def frames(self, ticker, statement, form='10-K'):
+        """rebuilds a ticker's stored statements as one wide DataFrame per
+        fiscal year, shaped like the csv files (account column, a value column
+        per period, period ends on the first row) so column_change applies"""
+
+        df = self.read(tickers=[ticker], statements=[statement], forms=[form])
+        if df.empty:
+            return []
+
+        frames = []
+        for fiscal_year, group in df.groupby('fiscal_year', observed=True):
+            group = group.sort_values(['line', 'period'], ascending=[True, False])
+            wide = group.pivot(index='line', columns='period', values='value')
+            wide = wide[sorted(wide.columns, reverse=True)]
+
+            labels = group.drop_duplicates('period').set_index('period')['period_label']
+
+            accounts = group.drop_duplicates('line').set_index('line')['account'].astype(object)
+            frame = pd.DataFrame({'Accounts': accounts.replace('', np.nan)})
+            for i, period in enumerate(wide.columns, start=1):
+                frame[f'Unnamed: {i}'] = wide[period]
+
+            header = pd.DataFrame([[np.nan] + [labels[period] for period in wide.columns]],
+                                  columns=frame.columns)
+            frames.append(pd.concat([header, frame], ignore_index=True))
+
+        return frames
+
+
+    def panel(self, tickers=None, statements=None, form='10-K'):
+        """canonical long panel of (ticker, statement, account, occurrence,
+        period, value) across tickers, with the fiscal_year of the filing each
+        value came from and its line in that filing
+
+        restated figures: every annual filing reports prior years again, when
+        several filings carry the same ticker, statement, account and period
+        the value from the latest filing (highest fiscal_year) is kept"""
+
+        columns = ['ticker', 'statement', 'account', 'occurrence', 'period',
+                   'value', 'fiscal_year', 'line']
+        df = self.read(tickers=tickers, statements=statements, columns=columns, forms=[form])
+        if df.empty:
+            return pd.DataFrame(columns=columns)
+        df['fiscal_year'] = df['fiscal_year'].astype('int16')
+
+        df = df.sort_values('fiscal_year', kind='stable')
+        df = df.drop_duplicates(['ticker', 'statement', 'account', 'occurrence', 'period'],
+                                keep='last')
+
+        return df.sort_values(['ticker', 'statement', 'line', 'period'], ignore_index=True)
+
+
+    def import_csv(self, ticker, form='10-K'):
+        """backfills the store from a ticker's existing csv files, returns
+        the number of rows written"""
+
+        written = 0
+        for statement, folder in STATEMENT_FOLDERS.items():
+            path = str(Path(''.join([os.getcwd(), f'/data/{ticker.lower()}_reports/'
+                                                  f'{form}s/csv/{folder}'])))
+            if not os.path.exists(path):
+                continue
+
+            for file in os.listdir(path):
+                year = re.search(r'_(\d{4})\.csv$', file)
+                if year is None:
+                    continue
+
+                df = pd.read_csv(os.path.join(path, file))
+                written += self.write(ticker, statement, year.group(1), df, form=form)
+
+        return written
+
+
+def pivot_panel(panel, statement='income', tickers=None):
+    """wide view of a long panel for one statement: rows indexed by (ticker,
+    account, occurrence) in filing line order, a column per period"""
+
+    df = panel[panel['statement'].astype(str) == statement]
+    if tickers is not None:
+        df = df[df['ticker'].astype(str).isin([ticker.upper() for ticker in tickers])]
+
+    df = df.assign(ticker=df['ticker'].astype(str), account=df['account'].astype(str))
+
+    order = df.sort_values(['ticker', 'line']).drop_duplicates(['ticker', 'account', 'occurrence'])
+    index = pd.MultiIndex.from_frame(order[['ticker', 'account', 'occurrence']])
+
+    wide = df.pivot(index=['ticker', 'account', 'occurrence'], columns='period', values='value')
+
+    return wide.reindex(index=index, columns=sorted(wide.columns))
+
+
+_statement_store = None
+_statement_store_lock = threading.Lock()
+
+
+def statement_store():
+    """returns the process-wide StatementStore"""
+
+    global _statement_store
+
+    with _statement_store_lock:
+        if _statement_store is None:
+            _statement_store = StatementStore()
+
+    return _statement_store
+
+
+class ReportJob(NamedTuple):
+    """a Financial_Report.xlsx to download, folder is the filing's archive
+    folder, e.g. edgar/data/320193/000032019321000105"""
+
+    ticker: str
+    folder: str
+    form: str = '10-K'
+
+    @property
+    def url(self):
+        return f'/Archives/{self.folder}/Financial_Report.xlsx'
+
+
+class JobStatus(NamedTuple):
+    state: str
+    error: str = None
+    attempts: int = 0
+
+
+class ReportDownloader:
+    """downloads a batch of ReportJobs on a thread pool, each workbook exactly
+    once and within the SEC rate limit. downloaded bytes are handed to a
+    separate parse pool so parsing never holds up further downloads
+
+    handler(job, content) is called with each workbook, by default the
+    statements are written to csv with DataSEC.report_to_csv. status maps
+    every job to a JobStatus whose state is 'done', 'missing' (no workbook
+    for the filing) or 'failed' (the download or the handler raised, e.g. a
+    workbook without a fiscal year or statement sheets)"""
+
+    def __init__(self, session=None, workers=10, parse_workers=2,
+                 statement=None, handler=None):
+        self.session = sec_session() if session is None else session
+        self.workers = workers
+        self.parse_workers = parse_workers
+        self.statement = statement
+        self.handler = self._to_csv if handler is None else handler
+        self.status = {}
+        self._filers = {}
+
+
+    def _to_csv(self, job, content):
+        filer = self._filers.get(job.ticker)
+        if filer is None:
+            filer = self._filers[job.ticker] = DataSEC(job.ticker, session=self.session)
+
+        filer.report_to_csv(content, statement=self.statement, form=job.form,
+                            accession=job.folder.rsplit('/', 1)[-1])
+
+
+    def _download(self, job):
+        req = self.session.get(job.url)
+        if req.status_code == 404:
+            return None
+
+        req.raise_for_status()
+
+        return req.content
+
+
+    def _set_status(self, job, state, error=None):
+        attempts = self.status[job].attempts if job in self.status else 0
+        self.status[job] = JobStatus(state, error, attempts + 1)
+
+
+    def run(self, jobs):
+        """downloads and parses jobs, returns {job: JobStatus}"""
+
+        jobs = list(dict.fromkeys(jobs))
+
+        pbar = _progress(total=len(jobs))
+        pbar.set_description('Downloading reports')
+
+        with ThreadPoolExecutor(max_workers=self.parse_workers) as parser:
+            parsing = {}
+
+            with ThreadPoolExecutor(max_workers=self.workers) as downloader:
+                futures = {downloader.submit(self._download, job): job
+                           for job in jobs}
+
+                for future in as_completed(futures):
+                    job = futures[future]
+                    pbar.update(1)
+
+                    try:
+                        content = future.result()
+
+                    except Exception as e:
+                        self._set_status(job, 'failed', repr(e))
+                        continue
+
+                    if content is None:
+                        self._set_status(job, 'missing')
+                        continue
+
+                    parsing[parser.submit(self.handler, job, content)] = job
+
+            for future in as_completed(parsing):
+                job = parsing[future]
+                try:
+                    future.result()
+
+                except Exception as e:
+                    self._set_status(job, 'failed', repr(e))
+                    continue
+
+                self._set_status(job, 'done')
+
+        pbar.close()
+
+        return {job: self.status[job] for job in jobs}
+
+
+    def failed(self):
+        return [job for job, status in self.status.items()
+                if status.state == 'failed']
+
+
+    def retry_failed(self):
+        """runs the failed jobs again, returns their new status"""
+
+        return self.run(self.failed())
+
+
+class YahooPriceSource:
+    """adjusted closes from Yahoo through pandas_datareader"""
+
+    def __call__(self, symbols, start, end, interval='m'):
+        import pandas_datareader as pdr
+
+        data = pdr.get_data_yahoo(list(symbols), start, end, interval=interval)
+        data = data['Adj Close']
+
+        if isinstance(data, pd.Series):
+            data = data.to_frame(symbols[0])
+
+        return data
+
+
+class CSVPriceSource:
+    """stand-in price source reading {directory}/{symbol}.csv files with Date
+    and Adj Close columns, for running offline"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+
+    def __call__(self, symbols, start, end, interval='m'):
+        columns = {}
+        for symbol in symbols:
+            path = os.path.join(self.directory, f'{symbol}.csv')
+            df = pd.read_csv(path, index_col='Date', parse_dates=True)
+            columns[symbol] = df.loc[pd.Timestamp(start):pd.Timestamp(end), 'Adj Close']
+
+        return pd.DataFrame(columns)
+
+
+class PriceStore:
+    """local SQLite cache of adjusted closes keyed by symbol and interval.
+    a request only fetches the date ranges that are not on disk yet (before
+    the first or after the last fetched date, the latter once it is more than
+    max_staleness old), concurrent requests for the same symbol wait for one
+    fetch instead of repeating it. the source is any callable
+    source(symbols, start, end, interval) returning a date x symbol frame"""
+
+    def __init__(self, db_path=None, source=None, max_staleness=dt.timedelta(days=1)):
+        if db_path is None:
+            db_path = str(Path(''.join([os.getcwd(), '/data/market_data.sqlite'])))
+
+        self.db_path = db_path
+        self.source = YahooPriceSource() if source is None else source
+        self.max_staleness = max_staleness
+
+        self._lock = threading.Lock()
+        self._symbol_locks = {}
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS prices (
+                symbol TEXT NOT NULL,
+                interval TEXT NOT NULL,
+                date TEXT NOT NULL,
+                adj_close REAL,
+                PRIMARY KEY (symbol, interval, date)
+            );
+            CREATE TABLE IF NOT EXISTS price_coverage (
+                symbol TEXT NOT NULL,
+                interval TEXT NOT NULL,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL,
+                PRIMARY KEY (symbol, interval)
+            );
+            """
+        )
+
+
+    def _symbol_lock(self, symbol, interval):
+        with self._lock:
+            return self._symbol_locks.setdefault((symbol, interval), threading.Lock())
+
+
+    def _missing(self, symbol, interval, start, end):
+        """ranges of start..end to fetch. a refresh starts at the last stored
+        bar rather than where coverage ends, that bar may still have been
+        open (e.g. the current month) when it was stored"""
+
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT start, end FROM price_coverage WHERE symbol = ? AND interval = ?',
+                (symbol, interval)).fetchone()
+            last = self.conn.execute(
+                'SELECT MAX(date) FROM prices WHERE symbol = ? AND interval = ?',
+                (symbol, interval)).fetchone()[0]
+
+        if row is None:
+            return [(start, end)]
+
+        covered_start, covered_end = (dt.datetime.fromisoformat(x) for x in row)
+
+        missing = []
+        if start < covered_start:
+            missing.append((start, covered_start))
+        if end - covered_end > self.max_staleness:
+            refresh = covered_end if last is None else min(dt.datetime.fromisoformat(last), covered_end)
+            missing.append((refresh, end))
+
+        return missing
+
+
+    def _save(self, data, interval, start, end):
+        rows = [(symbol, interval, date.strftime('%Y-%m-%d'), float(value))
+                for symbol in data.columns
+                for date, value in data[symbol].dropna().items()]
+
+        with self._lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?)', rows)
+
+            for symbol in data.columns:
+                row = self.conn.execute(
+                    'SELECT start, end FROM price_coverage WHERE symbol = ? AND interval = ?',
+                    (symbol, interval)).fetchone()
+
+                covered = (start, end)
+                if row is not None:
+                    covered_start, covered_end = (dt.datetime.fromisoformat(x) for x in row)
+                    covered = (min(start, covered_start), max(end, covered_end))
+
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO price_coverage VALUES (?, ?, ?, ?)',
+                    (symbol, interval, covered[0].isoformat(), covered[1].isoformat()))
+
+
+    def update(self, symbols, start, end=None, interval='m'):
+        """fetches whatever part of start..end is missing for the symbols,
+        symbols missing the same range are fetched in one source call"""
+
+        if end is None:
+            end = dt.datetime.now()
+
+        symbols = sorted({symbol.upper() for symbol in symbols})
+        locks = [self._symbol_lock(symbol, interval) for symbol in symbols]
+
+        for lock in locks:
+            lock.acquire()
+        try:
+            ranges = {}
+            for symbol in symbols:
+                for missing in self._missing(symbol, interval, start, end):
+                    ranges.setdefault(missing, []).append(symbol)
+
+            for (range_start, range_end), group in ranges.items():
+                data = self.source(group, range_start, range_end, interval)
+                data.columns = [str(column).upper() for column in data.columns]
+                data = data.reindex(columns=group)
+
+                self._save(data, interval, range_start, range_end)
+
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+
+    def get(self, symbols, start, end=None, interval='m'):
+        """adjusted closes from start to end as a date x symbol frame, served
+        from disk after fetching any missing range"""
+
+        if isinstance(symbols, str):
+            symbols = [symbols]
+
+        if end is None:
+            end = dt.datetime.now()
+
+        self.update(symbols, start, end, interval)
+
+        keys = [symbol.upper() for symbol in symbols]
+        with self._lock:
+            df = pd.read_sql_query(
+                f'SELECT symbol, date, adj_close FROM prices WHERE interval = ? '
+                f'AND date BETWEEN ? AND ? AND symbol IN ({", ".join("?" * len(keys))})',
+                self.conn, params=[interval, start.strftime('%Y-%m-%d'),
+                                   end.strftime('%Y-%m-%d'), *keys])
+
+        df['date'] = pd.to_datetime(df['date'])
+        df = df.pivot(index='date', columns='symbol', values='adj_close')
+        df = df.reindex(columns=keys)
+        df.columns = list(symbols)
+
+        return df.rename_axis('Date')
+
+
+    def close(self):
+        self.conn.close()
+
+
+_price_store = None
+_price_store_lock = threading.Lock()
+
+
+def price_store():
+    """returns the process-wide PriceStore"""
+
+    global _price_store
+
+    with _price_store_lock:
+        if _price_store is None:
+            _price_store = PriceStore()
+
+    return _price_store
+
+
+def set_price_store(store):
+    """replaces the process-wide PriceStore, e.g. with one reading from a
+    CSVPriceSource"""
+
+    global _price_store
+
+    with _price_store_lock:
+        _price_store = store
+
+
+class CSVSeriesSource:
+    """stand-in FRED source reading {directory}/{series_id}.csv files with
+    date and value columns, for running offline"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+
+    def get_series(self, series_id):
+        path = os.path.join(self.directory, f'{series_id}.csv')
+        df = pd.read_csv(path, index_col=0, parse_dates=True)
+
+        return df.iloc[:, 0].rename(None)
+
+
+class FredStore:
+    """process-wide, disk-backed cache of FRED series. a series is served
+    from memory or SQLite while younger than ttl. after that, if the source
+    can report the series' last_updated vintage and it has not changed, the
+    cached copy is kept without downloading it again. concurrent requests for
+    the same series share one download. the source is a fredapi.Fred or any
+    object with get_series(series_id) (and optionally get_series_info)"""
+
+    def __init__(self, db_path=None, source=None, api_key=None, ttl=dt.timedelta(hours=12)):
+        if db_path is None:
+            db_path = str(Path(''.join([os.getcwd(), '/data/market_data.sqlite'])))
+
+        self.db_path = db_path
+        self.ttl = ttl
+        self.api_key = api_key
+        self._source = source
+
+        self._lock = threading.Lock()
+        self._series_locks = {}
+        self._memory = {}
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS fred_series (
+                series_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                value REAL,
+                PRIMARY KEY (series_id, date)
+            );
+            CREATE TABLE IF NOT EXISTS fred_meta (
+                series_id TEXT PRIMARY KEY,
+                fetched_at TEXT NOT NULL,
+                last_updated TEXT
+            );
+            """
+        )
+
+
+    @property
+    def source(self):
+        if self._source is None:
+            api_key = self.api_key if self.api_key is not None else os.environ['API_KEY']
+            from fredapi import Fred
+            self._source = Fred(api_key=api_key)
+
+        return self._source
+
+
+    def _series_lock(self, series_id):
+        with self._lock:
+            return self._series_locks.setdefault(series_id, threading.Lock())
+
+
+    def _meta(self, series_id):
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT fetched_at, last_updated FROM fred_meta WHERE series_id = ?',
+                (series_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        return dt.datetime.fromisoformat(row[0]), row[1]
+
+
+    def _read(self, series_id):
+        with self._lock:
+            df = pd.read_sql_query(
+                'SELECT date, value FROM fred_series WHERE series_id = ? ORDER BY date',
+                self.conn, params=[series_id])
+
+        return pd.Series(df['value'].to_numpy(), index=pd.to_datetime(df['date']))
+
+
+    def _last_updated(self, series_id):
+        get_info = getattr(self.source, 'get_series_info', None)
+        if get_info is None:
+            return None
+
+        try:
+            return str(get_info(series_id)['last_updated'])
+
+        except Exception:
+            return None
+
+
+    def _write(self, series_id, series, fetched_at, last_updated):
+        rows = [(series_id, date.strftime('%Y-%m-%d'), None if pd.isna(value) else float(value))
+                for date, value in series.items()]
+
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM fred_series WHERE series_id = ?', (series_id,))
+            self.conn.executemany('INSERT INTO fred_series VALUES (?, ?, ?)', rows)
+            self.conn.execute('INSERT OR REPLACE INTO fred_meta VALUES (?, ?, ?)',
+                              (series_id, fetched_at.isoformat(), last_updated))
+
+
+    def _touch(self, series_id, fetched_at):
+        with self._lock, self.conn:
+            self.conn.execute('UPDATE fred_meta SET fetched_at = ? WHERE series_id = ?',
+                              (fetched_at.isoformat(), series_id))
+
+
+    def get_series(self, series_id):
+        """the series as a date indexed pd.Series, like fredapi's get_series"""
+
+        with self._series_lock(series_id):
+            now = dt.datetime.now()
+
+            cached = self._memory.get(series_id)
+            if cached is not None and now - cached[1] < self.ttl:
+                return cached[0]
+
+            meta = self._meta(series_id)
+            if meta is not None and now - meta[0] < self.ttl:
+                series = self._read(series_id)
+                self._memory[series_id] = (series, meta[0])
+                return series
+
+            last_updated = self._last_updated(series_id)
+            if meta is not None and last_updated is not None and last_updated == meta[1]:
+                self._touch(series_id, now)
+                series = cached[0] if cached is not None else self._read(series_id)
+                self._memory[series_id] = (series, now)
+                return series
+
+            series = self.source.get_series(series_id)
+            self._write(series_id, series, now, last_updated)
+            self._memory[series_id] = (series, now)
+
+        return series
+
+
+    def prefetch(self, series_ids, workers=4):
+        """loads several series concurrently, returns {series_id: series}"""
+
+        series_ids = list(dict.fromkeys(series_ids))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(series_ids, executor.map(self.get_series, series_ids)))
+
+
+    def close(self):
+        self.conn.close()
+
+
+_fred_stores = {}
+_fred_stores_lock = threading.Lock()
+
+
+def fred_store(api_key=None):
+    """returns the process-wide FredStore for api_key, None stands for the
+    API_KEY environment variable. stores for different keys are separate
+    but share the same SQLite cache"""
+
+    with _fred_stores_lock:
+        store = _fred_stores.get(api_key)
+        if store is None:
+            store = _fred_stores[api_key] = FredStore(api_key=api_key)
+
+    return store
+
+
+def set_fred_store(store, api_key=None):
+    """replaces the process-wide FredStore for api_key, e.g. with one reading
+    from a CSVSeriesSource"""
+
+    with _fred_stores_lock:
+        _fred_stores[api_key] = store
+
+
+def _timed(call):
+    started = time.perf_counter()
+    value = call[0](*call[1:])
+
+    return value, time.perf_counter() - started
+
+
+def gather(calls, workers=None):
+    """runs named calls concurrently on a thread pool, calls is
+    {name: (func, *args)} with hashable args. identical calls run once and
+    their result is shared by every name asking for it. returns
+    ({name: result}, {name: seconds}). once all of them have finished, the
+    error of the call that failed first (in time) is raised"""
+
+    unique = list(dict.fromkeys(calls.values()))
+
+    error = None
+    with ThreadPoolExecutor(max_workers=workers or len(unique) or 1) as executor:
+        futures = {call: executor.submit(_timed, call) for call in unique}
+
+        for future in as_completed(futures.values()):
+            if error is None and future.exception() is not None:
+                error = future.exception()
+
+    if error is not None:
+        raise error
+
+    results, timings = {}, {}
+    for name, call in calls.items():
+        results[name], timings[name] = futures[call].result()
+
+    return results, timings
+
+
+_sql_engine = None
+_sql_engine_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def sql_schema():
+    """tables of the shared database
+
+    facts: one row per ticker, statement, form, account (repeated labels
+    numbered by occurrence) and period, keyed on those and indexed on
+    (statement, account, period) for cross-company queries. value is the
+    latest filing's figure, fiscal_year the filing it came from and line its
+    row in that filing
+
+    loaded_filings: the filing (accession, None for statements imported from
+    csv) each ticker's statement of a fiscal year was last loaded from"""
+
+    import sqlalchemy as db
+
+    metadata = db.MetaData()
+
+    db.Table(
+        'facts', metadata,
+        db.Column('ticker', db.String(16), primary_key=True),
+        db.Column('statement', db.String(16), primary_key=True),
+        db.Column('form', db.String(16), primary_key=True),
+        db.Column('account', db.String(512), primary_key=True),
+        db.Column('occurrence', db.SmallInteger, primary_key=True),
+        db.Column('period', db.SmallInteger, primary_key=True),
+        db.Column('value', db.Float),
+        db.Column('fiscal_year', db.SmallInteger),
+        db.Column('line', db.Integer),
+        db.Index('facts_statement_account_period', 'statement', 'account', 'period'),
+    )
+
+    db.Table(
+        'loaded_filings', metadata,
+        db.Column('ticker', db.String(16), primary_key=True),
+        db.Column('statement', db.String(16), primary_key=True),
+        db.Column('form', db.String(16), primary_key=True),
+        db.Column('fiscal_year', db.SmallInteger, primary_key=True),
+        db.Column('accession', db.String(32)),
+        db.Column('rows', db.Integer),
+        db.Column('loaded_at', db.DateTime),
+    )
+
+    return metadata
+
+
+def facts_table():
+    return sql_schema().tables['facts']
+
+
+def loaded_filings_table():
+    return sql_schema().tables['loaded_filings']
+
+
+def create_engine(url=None, pool_size=5, max_overflow=10):
+    """pooled engine for DB_URL + DB_NAME (defaults to 'pyib'), creating the
+    database and its tables if missing"""
+
+    import sqlalchemy as db
+    from sqlalchemy_utils import database_exists, create_database
+
+    if url is None:
+        url = ''.join([os.environ['DB_URL'], os.environ.get('DB_NAME', 'pyib')])
+
+    if db.engine.make_url(url).get_backend_name() == 'sqlite':
+        engine = db.create_engine(url)
+    else:
+        engine = db.create_engine(url, pool_size=pool_size, max_overflow=max_overflow,
+                                  pool_pre_ping=True)
+
+    if not database_exists(engine.url):
+        create_database(engine.url)
+
+    sql_schema().create_all(engine)
+
+    return engine
+
+
+def sql_engine():
+    """returns the process-wide engine, created on first use"""
+
+    global _sql_engine
+
+    with _sql_engine_lock:
+        if _sql_engine is None:
+            _sql_engine = create_engine()
+
+    return _sql_engine
+
+
+def set_sql_engine(engine):
+    """replaces the process-wide engine, e.g. with one from create_engine for
+    another url. missing tables are created"""
+
+    global _sql_engine
+
+    sql_schema().create_all(engine)
+
+    with _sql_engine_lock:
+        _sql_engine = engine
+
+
+def query_facts(tickers=None, statements=None, accounts=None, periods=None,
+                form='10-K', engine=None):
+    """facts of any number of companies in one indexed SELECT, optionally only
+    the given tickers, statements, accounts and periods. returns long rows
+    ordered by ticker, statement, line and period"""
+
+    import sqlalchemy as db
+
+    tickers, statements, accounts = ([values] if isinstance(values, str) else values
+                                     for values in (tickers, statements, accounts))
+
+    table = facts_table()
+    query = db.select(table).where(table.c.form == form)
+
+    if tickers is not None:
+        query = query.where(table.c.ticker.in_([ticker.upper() for ticker in tickers]))
+    if statements is not None:
+        query = query.where(table.c.statement.in_(list(statements)))
+    if accounts is not None:
+        query = query.where(table.c.account.in_(list(accounts)))
+    if periods is not None:
+        query = query.where(table.c.period.in_([int(period) for period in periods]))
+
+    query = query.order_by(table.c.ticker, table.c.statement, table.c.line, table.c.period)
+
+    engine = sql_engine() if engine is None else engine
+    with engine.connect() as conn:
+        result = conn.execute(query)
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+
+class LoadStats(NamedTuple):
+    """outcome of loading one ticker's facts"""
+
+    ticker: str
+    filings: int
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def _upsert(conn, table, rows, batch_size=5000):
+    """inserts rows, updating the ones whose primary key exists. uses the
+    dialect's native upsert on sqlite, postgresql and mysql, elsewhere deletes
+    the existing keys and inserts. rows go in batches of batch_size, each one
+    executemany round trip"""
+
+    import sqlalchemy as db
+
+    keys = [column.name for column in table.primary_key.columns]
+    values = [column.name for column in table.columns if column.name not in keys]
+
+    dialect = conn.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=keys, set_={name: statement.excluded[name] for name in values})
+
+    elif dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+
+        statement = insert(table)
+        statement = statement.on_duplicate_key_update(
+            {name: statement.inserted[name] for name in values})
+
+    else:
+        statement = None
+        delete = table.delete().where(db.and_(
+            *[table.c[key] == db.bindparam(f'key_{key}') for key in keys]))
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+
+        if statement is None:
+            conn.execute(delete, [{f'key_{key}': row[key] for key in keys} for row in batch])
+            conn.execute(table.insert(), batch)
+        else:
+            conn.execute(statement, batch)
+
+
+def _records(df):
+    """DataFrame rows as dicts of plain python values, NaN as None"""
+
+    df = df.astype(object).where(df.notna(), None)
+
+    return df.to_dict('records')
+
+
+def load_facts(ticker, statements=None, form='10-K', engine=None, store=None,
+               batch_size=5000):
+    """loads a ticker's statements from the statement store (backfilled from
+    its csv files when empty) into the facts table, in one transaction
+
+    only filings not loaded before are read: a statement's fiscal year is
+    skipped when loaded_filings already has it from the same accession. their
+    facts are upserted in batches, where several filings report the same
+    figure the latest fiscal year wins, also against facts already in the
+    table. returns a LoadStats with the rows written and the time taken"""
+
+    import sqlalchemy as db
+
+    started = time.perf_counter()
+
+    ticker = ticker.upper()
+    statements = list(STATEMENT_FOLDERS) if statements is None else list(statements)
+
+    store = statement_store() if store is None else store
+    columns = ['statement', 'account', 'occurrence', 'period', 'value', 'fiscal_year',
+               'line', 'accession']
+
+    df = store.read(tickers=[ticker], statements=statements, columns=columns, forms=[form])
+    if df.empty:
+        store.import_csv(ticker, form=form)
+        df = store.read(tickers=[ticker], statements=statements, columns=columns, forms=[form])
+
+    if df.empty:
+        return LoadStats(ticker, 0, 0, time.perf_counter() - started)
+
+    df = df.astype({'statement': str, 'account': str, 'occurrence': int, 'period': int,
+                    'fiscal_year': int, 'line': int, 'accession': object})
+    df['accession'] = df['accession'].where(df['accession'].notna(), '')
+
+    facts = facts_table()
+    filings = loaded_filings_table()
+
+    engine = sql_engine() if engine is None else engine
+    with engine.begin() as conn:
+        result = conn.execute(
+            db.select(filings.c.statement, filings.c.fiscal_year, filings.c.accession)
+            .where(filings.c.ticker == ticker).where(filings.c.form == form)
+            .where(filings.c.statement.in_(statements)))
+        loaded = pd.DataFrame(result.fetchall(), columns=['statement', 'fiscal_year', 'accession'])
+        loaded['accession'] = loaded['accession'].fillna('')
+
+        new = df[['statement', 'fiscal_year', 'accession']].drop_duplicates()
+        new = new.merge(loaded.astype({'fiscal_year': int}), how='left', indicator=True)
+        new = new[new['_merge'] == 'left_only'].drop(columns='_merge')
+
+        if new.empty:
+            return LoadStats(ticker, 0, 0, time.perf_counter() - started)
+
+        rows = df.merge(new, on=['statement', 'fiscal_year', 'accession'])
+        rows = rows.sort_values('fiscal_year', kind='stable').drop_duplicates(
+            ['statement', 'account', 'occurrence', 'period'], keep='last')
+
+        result = conn.execute(
+            db.select(facts.c.statement, facts.c.account, facts.c.occurrence,
+                      facts.c.period, facts.c.fiscal_year)
+            .where(facts.c.ticker == ticker).where(facts.c.form == form)
+            .where(facts.c.statement.in_(list(new['statement'].unique()))))
+        existing = pd.DataFrame(result.fetchall(), columns=['statement', 'account', 'occurrence',
+                                                            'period', 'existing_year'])
+
+        if not existing.empty:
+            rows = rows.merge(existing.astype({'occurrence': int, 'period': int}), how='left',
+                              on=['statement', 'account', 'occurrence', 'period'])
+            rows = rows[rows['existing_year'].isna() | (rows['existing_year'] <= rows['fiscal_year'])]
+
+        rows = rows.assign(ticker=ticker, form=form)
+        _upsert(conn, facts, _records(rows[[column.name for column in facts.columns]]),
+                batch_size=batch_size)
+
+        counts = rows.groupby(['statement', 'fiscal_year']).size().rename('rows')
+        new = new.join(counts, on=['statement', 'fiscal_year']).fillna({'rows': 0})
+        new = new.assign(ticker=ticker, form=form, loaded_at=dt.datetime.now(),
+                         accession=new['accession'].where(new['accession'] != '', None))
+        _upsert(conn, filings, _records(new[[column.name for column in filings.columns]]))
+
+    return LoadStats(ticker, len(new), len(rows), time.perf_counter() - started)
+
+
+def load_facts_bulk(tickers, statements=None, form='10-K', engine=None, batch_size=5000):
+    """load_facts for many tickers, one transaction each, showing the load
+    rate on the progress bar. returns a LoadStats per ticker"""
+
+    stats = []
+    rows, seconds = 0, 0.0
+
+    pbar = _progress(tickers)
+    pbar.set_description('Loading facts')
+    for ticker in pbar:
+        stat = load_facts(ticker, statements=statements, form=form, engine=engine,
+                          batch_size=batch_size)
+        stats.append(stat)
+
+        rows += stat.rows
+        seconds += stat.seconds
+        pbar.set_postfix(rows=rows, rows_per_second=f'{rows / seconds:.0f}' if seconds else 0)
+
+    return stats
 
 
 class DataJSON:
@@ -46,66 +2048,49 @@ class DataJSON:
     def get_cik_json(self):
         """loads company's CIK from default filepath"""
 
-        with open(self.filepath) as f:
-            data = json.load(f)
-
-        for info in data.values():
-            if info['ticker'] == self.ticker.upper():
-                cik = info['cik_str']
-
-                return cik
+        return ticker_index(self.filepath).cik(self.ticker)
 
 
     def get_exchange_json(self):
         """loads company's exchange from default filepath"""
 
-        with open(self.filepath) as f:
-            f = json.load(f)
-
-            for key, value in f.items():
-                if value['ticker'] == self.ticker.upper():
-                    exchange = value['exchange']
-
-                    return exchange
+        return ticker_index(self.filepath).exchange(self.ticker)
 
 
 class DataSEC(DataJSON):
+    """the CIK and the HTTP session are looked up on first use, so creating
+    many of these is cheap"""
 
-    def __init__(self, ticker):
+    def __init__(self, ticker, session=None):
         super().__init__(ticker)
-        self.cik = self.get_cik_json()
+        self._session = session
 
-        self.heads = {'Host': 'www.sec.gov', 'Connection': 'close',
-                      'Accept': 'application/json, text/javascript, */*; q=0.01',
-                      'X-Requested-With': 'XMLHttpRequest',
-                      'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.163 Safari/537.36',
-                      }
+        self.heads = dict(SEC_HEADERS)
 
 
-    @limits(calls=10, period=1)
-    def download_master_index(self, year=dt.date.today().year):
+    @cached_property
+    def cik(self):
+        return self.get_cik_json()
 
-        qtr = 1
-        while qtr < 5: 
-            try:
-                url = f"https://www.sec.gov/Archives/edgar/full-index/{year}/QTR{qtr}/master.idx"
-                response = requests.get(url, headers=self.heads)
-                response.raise_for_status()
 
-                down_direct = str(Path(''.join([os.getcwd(),'/data/edgar_master_index'])))
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = sec_session()
 
-                filename = f'/master{year}QTR{qtr}.txt'
-                path = str(Path(''.join([down_direct, filename])))
+        return self._session
 
-                if not os.path.exists(path):
-                    print(url)
-                    with open(path, 'wb') as f:
-                        f.write(response.content)
 
-                qtr += 1
+    def download_master_index(self, year=None, end_year=None, revalidate=False,
+                              workers=4):
+        """downloads the master index files of year (defaults to the current
+        year) through end_year, see download_master_indexes"""
 
-            except requests.HTTPError:
-                continue
+        if year is None:
+            year = dt.date.today().year
+
+        return download_master_indexes(year, end_year, session=self.session,
+                                       revalidate=revalidate, workers=workers)
 
 
     def get_year(self, df):
@@ -114,151 +2099,90 @@ class DataSEC(DataJSON):
 
         return dates
 
-    @limits(calls=10, period=1)
-    def to_csv(self, url, statement=None, form='10-K'):
-        req = requests.get(url, headers=self.heads, stream=True)
-
-        if statement == 'income':
-            sheet_names = [
-                'Consolidated Statements of Inco',
-                'CONSOLIDATED STATEMENTS OF INCO',
-                'Consolidated_Statements_of_Inco',
-                'Consolidated Statements of Oper',
-                'CONSOLIDATED STATEMENTS OF OPER'
-            ]
-            folder = 'income_statements'
-
-        elif statement == 'balance':
-            sheet_names = [
-                'Consolidated_Balance_Sheets',
-                'Consolidated Balance Sheets',
-                'CONSOLIDATED BALANCE SHEETS'
-            ]
-            folder = 'balance_sheets'
-
-        elif statement == 'cash':
-            sheet_names = [
-                'Consolidated_Statements_of_Cash',
-                'Consolidated Statements of Cash',
-                'CONSOLIDATED STATEMENTS OF CASH'
-            ]
-            folder = 'cash_flow_statements'
-
-        try:
-            cwd = os.getcwd()
-            dst = f'/data/{self.ticker.lower()}_reports/{form}s/csv/{folder}/'
-
-            directory = str(Path(''.join([cwd, dst])))
-            if not os.path.exists(directory):
-                os.makedirs(directory)
-
-            temporary_xlsx = f'{self.ticker.lower()}.xlsx'
-            temp_path = str(Path(''.join([cwd, '/', temporary_xlsx])))
-            if req.status_code == 200:
-                with open(temp_path, 'wb') as f:
-                    for chunk in req.iter_content(chunk_size=15000):
-                        f.write(chunk)
+    def fetch_report(self, url):
+        """downloads a Financial_Report.xlsx, returns its bytes or None"""
 
-            df = pd.read_excel(temporary_xlsx)
-            year_ended = self.get_year(df)[0]
-
-            filename = f'{self.ticker.lower()}_{year_ended}.csv'
-            path = str(Path(''.join([cwd, dst, filename])))
+        req = self.session.get(url, headers=self.heads)
+        if req.status_code != 200:
+            return None
 
-            if not os.path.exists(path):
+        return req.content
 
 
-                pbar = tqdm(sheet_names)
-                for name in pbar:
-                    pbar.set_description(name)
-                    try:
+    def report_to_csv(self, content, statement=None, form='10-K', accession=None):
+        """writes statements of an already downloaded Financial_Report.xlsx to
+        csv and to the statement store, all three when statement is None. the
+        workbook is parsed once for all of them. raises ValueError when the
+        workbook has no fiscal year or none of the statements"""
 
-                        df = pd.read_excel(temp_path, sheet_name=name)
-                        df.to_csv(path, index=False)
+        statements = list(STATEMENT_TITLES) if statement is None else [statement]
 
-                    except ValueError:
-                        continue
+        report = read_report(content, statements, filer=self.cik)
+        if report.year_ended is None:
+            raise ValueError(f'no fiscal year found in {self.ticker} report')
 
-            os.remove(temp_path)
+        if not report.statements:
+            raise ValueError(f'no {", ".join(statements)} statement sheet found in '
+                             f'{self.ticker} report')
 
-        except UnboundLocalError:
-            pass
+        cwd = os.getcwd()
+        for stmt, df in report.statements.items():
+            dst = f'/data/{self.ticker.lower()}_reports/{form}s/csv/{STATEMENT_FOLDERS[stmt]}/'
 
-        if statement == None:
-            statements = ['income', 'balance', 'cash']
-            [self.to_csv(url, statement=stmt) for stmt in statements]
+            directory = str(Path(''.join([cwd, dst])))
+            os.makedirs(directory, exist_ok=True)
 
+            filename = f'{self.ticker.lower()}_{report.year_ended}.csv'
+            path = str(Path(''.join([cwd, dst, filename])))
 
-    @limits(calls=10, period=1)
-    def get_filings(self, form='10-K'):
-        """scrapes master index files for enpoints
-        these endpoints are used to download excel files of company financials
-        provided by the SEC"""
+            if not os.path.exists(path):
+                df.to_csv(path, index=False)
 
-        master_index = str(Path(''.join([os.getcwd(), '/data/edgar_master_index/'])))
+            statement_store().write(self.ticker, stmt, report.year_ended, df,
+                                    form=form, accession=accession)
 
-        directory = os.listdir(master_index)
 
-        r = re.compile(f'({form}).(\d+.\d+.\d+).(edgar/data/{self.cik}/)(' \
-                       f'\d+.\d+.\d+)')
+    def to_csv(self, url, statement=None, form='10-K'):
+        content = self.fetch_report(url)
 
-        downloads = []
+        if content is not None:
+            accession = url.rstrip('/').split('/')[-2]
+            self.report_to_csv(content, statement=statement, form=form,
+                               accession=accession)
 
-        i = 0
-        pbar = tqdm(total=len(directory))
-        pbar.set_description('Scanning master index')
-        while i < len(directory):
 
-            for file in directory:
-                doc = str(Path(''.join([master_index,'/', file])))
+    def get_filings(self, form='10-K', refresh=True):
+        """looks up the company's filings in the master index store
+        these endpoints are used to download excel files of company financials
+        provided by the SEC. returns (form, date filed, domain, accession)
+        tuples ordered by date filed"""
 
-                with open(doc) as f:
-                    try:
-                        regex = r.findall(f.read())
+        store = master_index_store()
+        if refresh:
+            store.sync()
 
-                        for item in regex:
-                            downloads.append(item)
+        domain = f'edgar/data/{self.cik}/'
 
-                    except UnicodeDecodeError:
-                        continue
+        downloads = []
+        for form_type, date_filed, filename in store.query(self.cik, form):
+            accession = filename[len(domain):].rsplit('.', 1)[0]
+            downloads.append((form_type, date_filed, domain, accession))
 
-            pbar.update(1)
-            i += 1
-        pbar.close()
         return downloads
 
 
-    @limits(calls=10, period=1)
     def download_files(self, statement=None, form='10-K'):
-        """for downloading excel of company financials from SEC website"""
-        downloads = self.get_filings()
-
-        accession = [download[-1] for download in downloads]
-        domain = [download[-2] for download in downloads]
-
-        formatted_accession = [accession.pop().replace('-', '') for _ in
-                               accession]
-
-        formatted = [''.join([domain[0], number]) for number in
-                     formatted_accession]
-
-        i = 0
-        pbar = tqdm(total=len(formatted))
+        """for downloading excel of company financials from SEC website.
+        returns the downloader, whose status holds the outcome of each filing"""
+        downloads = self.get_filings(form=form)
 
-        while i < len(formatted):
-            pbar.set_description(f'Downloading {formatted[i]}')
-            try:
-                url = f'https://www.sec.gov/Archives/' \
-                      f'{formatted[i]}/Financial_Report.xlsx'
-
-                self.to_csv(url, statement=statement, form=form)
+        jobs = [ReportJob(self.ticker, ''.join([domain, accession.replace('-', '')]), form)
+                for _, _, domain, accession in reversed(downloads)]
 
-            except Exception:
-                continue
+        downloader = ReportDownloader(session=self.session, statement=statement)
+        downloader.run(jobs)
 
-            pbar.update(1)
-            i += 1
-        pbar.close()
+        return downloader
 
 
     def column_change(self, statements):
@@ -288,143 +2212,100 @@ class DataSEC(DataJSON):
                 continue
 
 
-    def load_income_statements(self, form='10-K'):
-
-        sheets = []
+    def _load_statements(self, statement, form='10-K'):
+        """loads a statement's filings from the statement store, downloading
+        them first if nothing is stored, falls back to csv files that
+        predate the store"""
 
-        path = str(Path(''.join([os.getcwd(), f'/data/{self.ticker}_reports/'
-                                     f'{form}s/csv/income_statements/'])))
+        store = statement_store()
+        sheets = store.frames(self.ticker, statement, form=form)
 
-        if not os.path.exists(path):
-            self.download_files(statement='income', form=form)
+        path = str(Path(''.join([os.getcwd(), f'/data/{self.ticker.lower()}_reports/'
+                                              f'{form}s/csv/{STATEMENT_FOLDERS[statement]}'])))
 
-        directory = os.listdir(path)
+        if not sheets and not os.path.exists(path):
+            self.download_files(statement=statement, form=form)
+            sheets = store.frames(self.ticker, statement, form=form)
 
-        pbar = tqdm(directory)
-        for file in pbar:
-            pbar.set_description(f'Loading income statements from {file}')
-            try:
-                filename = ''.join([path, file])
-                df = pd.read_csv(filename)
-                sheets.append(df)
+        if not sheets and os.path.exists(path):
+            pbar = _progress(os.listdir(path))
+            for file in pbar:
+                pbar.set_description(f'Loading {STATEMENT_FOLDERS[statement]} from {file}')
+                try:
+                    df = pd.read_csv(os.path.join(path, file))
+                    sheets.append(df)
 
-            except Exception:
-                continue
+                except Exception:
+                    continue
 
         self.column_change(sheets)
 
         return sheets
 
 
-    def load_balance_sheets(self, form='10-K'):
-
-        sheets = []
-
-        path = str(Path(''.join([os.getcwd(), f'/data/{self.ticker.lower()}_reports/'
-                                     f'{form}s/csv/balance_sheets/'])))
-
-        if not os.path.exists(path):
-            self.download_files(statement='balance', form=form)
-
-        directory = os.listdir(path)
-
-        pbar = tqdm(directory)
-        for file in pbar:
-            pbar.set_description(f'Loading balance sheets from {file}')
-            try:
-                filename = ''.join([path, file])
-                df = pd.read_csv(filename)
-                sheets.append(df)
-
-            except Exception:
-                continue
+    def load_income_statements(self, form='10-K'):
+        return self._load_statements('income', form=form)
 
-        self.column_change(sheets)
 
-        return sheets
+    def load_balance_sheets(self, form='10-K'):
+        return self._load_statements('balance', form=form)
 
 
     def load_cash_flow_statements(self, form='10-K'):
+        return self._load_statements('cash', form=form)
 
-        sheets = []
-
-        path = str(Path(''.join([os.getcwd(), f'/data/{self.ticker.lower()}_reports/'
-                                     f'{form}s/csv/cash_flow_statements/'])))
-
-        if not os.path.exists(path):
-            self.download_files(statement='cash', form=form)
 
-        directory = os.listdir(path)
-
-        if len(directory) == 0:
-            self.to_csv(statement='cash')
+class DataSQL(DataSEC):
+    """statements of a ticker in the shared facts table. all instances use
+    the process-wide pooled engine, conn is checked out of the pool on first
+    use and close() (or leaving a with block) returns it"""
 
-        pbar = tqdm(directory)
-        for file in pbar:
-            pbar.set_description(f'Loading income statements from {file}')
-            try:
-                filename = ''.join([path, file])
-                df = pd.read_csv(filename)
-                sheets.append(df)
+    def __init__(self, ticker, session=None):
+        super().__init__(ticker, session=session)
 
-            except Exception:
-                continue
 
-        self.column_change(sheets)
+    @property
+    def engine(self):
+        return sql_engine()
 
-        return sheets
 
+    @cached_property
+    def conn(self):
+        return self.engine.connect()
 
-class DataSQL(DataSEC):
-    def __init__(self, ticker):
-        super().__init__(ticker)
-        url = os.environ['DB_URL']
 
-        self.engine = db.create_engine(''.join([url, self.ticker.lower()]))
+    def close(self):
+        """returns the connection to the pool if it was opened, it is checked
+        out again on next use"""
 
-        if not database_exists(self.engine.url):
-            create_database(self.engine.url)
+        conn = self.__dict__.pop('conn', None)
+        if conn is not None:
+            conn.close()
 
-        self.conn = self.engine.connect()
 
-    def csv_to_sql(self, statement=None, form='10-K'):
+    def __enter__(self):
+        return self
 
-        try:
-            if statement == 'income':
-                statements = self.load_income_statements_csv()
-                folder = 'income_statements'
 
-            elif statement == 'balance':
-                statements = self.load_balance_sheets_csv()
-                folder = 'balance_sheets'
+    def __exit__(self, *exc):
+        self.close()
 
-            elif statement == 'cash':
-                statements = self.load_cash_flow_statements_csv()
-                folder = 'cash_flow_statements'
 
-            try:
-                path = str(Path(''.join(
-                    [os.getcwd(), f'/data/{self.ticker.lower()}_reports/'
-                                  f'{form}s/csv/{folder}/'])))
+    def csv_to_sql(self, statement=None, form='10-K'):
+        """loads the ticker's filings of statement (all three by default)
+        that are not in the facts table yet, see load_facts. returns a
+        LoadStats with the rows written and rows/s"""
 
-                if not os.path.exists(path):
-                    os.makedirs(path)
+        statements = None if statement is None else [statement]
 
-                i = 0
-                while i < len(statements):
-                    statements[i].to_sql(f'{statement}_{i}', self.conn,
-                                         if_exists='replace')
-                    i += 1
+        return load_facts(self.ticker, statements=statements, form=form, engine=self.engine)
 
-            except Exception:
 
-                statements = ['income', 'balance', 'cash']
-                for i in statements:
-                    self.csv_to_sql(statement=i, form=form)
+    def facts(self, statements=None, accounts=None, periods=None, form='10-K'):
+        """the ticker's facts, see query_facts"""
 
-        except Exception:
-            self.to_csv()
-            self.csv_to_sql()
+        return query_facts([self.ticker], statements=statements, accounts=accounts,
+                           periods=periods, form=form, engine=self.engine)
 
 
     '''def create_table(self, table_name):
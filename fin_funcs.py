@@ -4,16 +4,13 @@ import datetime as dt
 import os
 import re
 import pandas as pd
-import requests
-from ratelimit import limits
 from tqdm.auto import tqdm
 import constants as c
 
 
 random_ua = generate_user_agent()
 
-heads = {'Host': 'www.sec.gov', 'Connection': 'close',
-         'Accept': 'application/json, text/javascript, */*; q=0.01', 'X-Requested-With': 'XMLHttpRequest',
+heads = {'Accept': 'application/json, text/javascript, */*; q=0.01', 'X-Requested-With': 'XMLHttpRequest',
          'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.163 Safari/537.36',
          }
 
@@ -39,9 +36,9 @@ for name in tqdm(formatted, bar_format='Downloading files'):
         path = ''.join([dstdir, rename])
         i += 1
 
-        url = f'https://www.sec.gov/Archives/{name}/Financial_Report.xlsx'
+        url = f'/Archives/{name}/Financial_Report.xlsx'
 
-        req = requests.get(url, headers=heads, stream=True)
+        req = c.s.get(url, headers=heads, stream=True)
 
         if req.status_code == 200:
             with open(path, 'wb') as f:
@@ -0,0 +1,235 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from data_ops import StatementStore, pivot_panel, statement_store
+
+
+# revenue lines in order of preference, the last one a statement has is used
+REVENUE_ACCOUNTS = ['Net sales', 'Revenue']
+
+
+def project(values, growth, periods=5):
+    """projects statement values `periods` steps past their last column in one
+    broadcasted operation, step k of an account is ceil(last * (1 + g) ** k)
+
+    values is an array of accounts x history (any leading axes, e.g.
+    tickers x accounts x history), growth a scalar or an array broadcastable
+    to the leading axes, so accounts or tickers can each have their own rate.
+    returns history and projections side by side as float64"""
+
+    values = np.asarray(values, dtype=np.float64)
+    factor = 1 + np.broadcast_to(np.asarray(growth, dtype=np.float64), values.shape[:-1])
+
+    steps = np.arange(1, periods + 1)
+    projected = np.ceil(values[..., -1:] * factor[..., None] ** steps)
+
+    return np.concatenate([values, projected], axis=-1)
+
+
+def forecast_columns(columns, periods=5):
+    """the statement's year columns as ints followed by the next `periods`
+    years"""
+
+    years = [int(column) for column in columns]
+
+    return [*years, *range(years[-1] + 1, years[-1] + 1 + periods)]
+
+
+def _numeric_rows(df):
+    numeric = df.apply(pd.to_numeric, errors='coerce')
+
+    return numeric[numeric.notna().all(axis=1)]
+
+
+def forecast_frame(df, growth, periods=5):
+    """forecasts every account of a formatted statement (accounts x years).
+    rows that are not numeric, like the period end dates, are left out.
+    growth is a scalar, an array with a rate per remaining row or a Series of
+    rates indexed by account"""
+
+    numeric = _numeric_rows(df)
+
+    if isinstance(growth, pd.Series):
+        growth = growth.reindex(numeric.index).to_numpy(dtype=np.float64)
+
+    projected = project(numeric.to_numpy(), growth, periods=periods)
+
+    return pd.DataFrame(projected, index=numeric.index,
+                        columns=forecast_columns(list(df.columns), periods))
+
+
+def simulate(values, growth_mean, growth_std, periods=5, paths=10000,
+             percentiles=(5, 50, 95), seed=None, max_elements=2 ** 24):
+    """monte carlo projection of statement values (accounts x history)
+
+    draws `paths` growth paths with a seedable generator, growth in year t is
+    growth_mean + growth_std * z_t with one standard normal shock per path
+    and year shared by all accounts (they all move with revenue). mean and
+    std are scalars or per account arrays. every account is projected along
+    every path as one paths x accounts x periods tensor, built for chunks of
+    accounts so it stays under max_elements. returns the percentile bands as
+    an array of percentiles x accounts x periods"""
+
+    values = np.asarray(values, dtype=np.float64)
+    accounts = values.shape[0]
+
+    mean = np.broadcast_to(np.asarray(growth_mean, dtype=np.float64), (accounts,))
+    std = np.broadcast_to(np.asarray(growth_std, dtype=np.float64), (accounts,))
+
+    rng = np.random.default_rng(seed)
+    shocks = rng.standard_normal((paths, 1, periods))
+
+    chunk = max(1, max_elements // (paths * periods))
+    bands = np.empty((len(percentiles), accounts, periods))
+
+    for start in range(0, accounts, chunk):
+        stop = min(start + chunk, accounts)
+
+        growth = mean[None, start:stop, None] + std[None, start:stop, None] * shocks
+        paths_values = values[None, start:stop, -1:] * np.cumprod(1 + growth, axis=-1)
+
+        bands[:, start:stop] = np.percentile(paths_values, percentiles, axis=0)
+
+    return bands
+
+
+def simulate_frame(df, growth_mean, growth_std, periods=5, paths=10000,
+                   percentiles=(5, 50, 95), seed=None):
+    """percentile bands of a formatted statement's forecast, indexed by
+    (percentile, account) with a column per forecast year"""
+
+    numeric = _numeric_rows(df)
+
+    if isinstance(growth_mean, pd.Series):
+        growth_mean = growth_mean.reindex(numeric.index).to_numpy(dtype=np.float64)
+    if isinstance(growth_std, pd.Series):
+        growth_std = growth_std.reindex(numeric.index).to_numpy(dtype=np.float64)
+
+    bands = simulate(numeric.to_numpy(), growth_mean, growth_std, periods=periods,
+                     paths=paths, percentiles=percentiles, seed=seed)
+
+    index = pd.MultiIndex.from_product([list(percentiles), numeric.index],
+                                       names=['percentile', numeric.index.name])
+    columns = forecast_columns(list(df.columns), periods)[-periods:]
+
+    return pd.DataFrame(bands.reshape(-1, periods), index=index, columns=columns)
+
+
+def sensitivity_grid(df, growth_rates, horizons):
+    """every account's last value grown at each rate for each horizon in one
+    broadcast, columns are (growth rate, horizon in years)"""
+
+    numeric = _numeric_rows(df)
+
+    rates = np.asarray(growth_rates, dtype=np.float64)
+    horizons = np.asarray(horizons)
+
+    grid = numeric.to_numpy()[:, -1, None, None] * (1 + rates)[None, :, None] ** horizons[None, None, :]
+
+    columns = pd.MultiIndex.from_product([rates, horizons], names=['growth', 'horizon'])
+
+    return pd.DataFrame(grid.reshape(len(numeric), -1), index=numeric.index, columns=columns)
+
+
+def _revenue_growth(wide):
+    """last revenue growth rate per ticker of a wide (ticker, account,
+    occurrence) x period income statement panel"""
+
+    accounts = wide.index.get_level_values('account')
+    occurrence = wide.index.get_level_values('occurrence')
+
+    rates = []
+    for account in REVENUE_ACCOUNTS:
+        rows = wide[(accounts == account) & (occurrence == 0)]
+        values = rows.to_numpy(dtype=np.float64)
+
+        positions = np.where(np.isnan(values), -1, np.arange(values.shape[1]))
+        last = positions.max(axis=1)
+        positions[np.arange(len(values)), last] = -1
+        previous = positions.max(axis=1)
+
+        found = (last >= 0) & (previous >= 0)
+        row = np.arange(len(values))[found]
+
+        rates.append(pd.Series(values[row, last[found]] / values[row, previous[found]] - 1,
+                               index=rows.index.get_level_values('ticker')[found]))
+
+    growth = pd.concat(rates)
+
+    return growth[~growth.index.duplicated(keep='last')]
+
+
+def _forecast_panel(wide, periods):
+    growth = _revenue_growth(wide)
+
+    tickers = wide.index.get_level_values('ticker')
+    wide = wide[tickers.isin(growth.index)]
+    tickers = wide.index.get_level_values('ticker')
+
+    # companies whose latest filing covers the same year share one projection
+    last = wide.notna().to_numpy().cumsum(axis=1).argmax(axis=1)
+    last = pd.Series(last, index=tickers).groupby(level=0).max()
+
+    frames = []
+    for position, group in last.groupby(last):
+        columns = list(wide.columns[:position + 1])
+        sub = wide.loc[tickers.isin(group.index), columns]
+
+        # blanks inside a company's reported years count as zero, like the
+        # formatted statement, years it never reported stay empty
+        reported = sub.notna().groupby(level='ticker').transform('any')
+        sub = sub.mask(reported & sub.isna(), 0)
+
+        rates = growth.reindex(sub.index.get_level_values('ticker')).to_numpy()
+        projected = project(sub.to_numpy(), rates, periods=periods)
+
+        frames.append(pd.DataFrame(projected, index=sub.index,
+                                   columns=forecast_columns(columns, periods)))
+
+    if not frames:
+        return pd.DataFrame()
+
+    df = pd.concat(frames)
+
+    return df.reindex(index=wide.index, columns=sorted(df.columns))
+
+
+def _forecast_chunk(tickers, periods, root, form):
+    return forecast_universe(tickers, periods=periods, root=root, form=form, workers=1)
+
+
+def forecast_universe(tickers, periods=5, root=None, form='10-K', workers=1):
+    """forecasts the income statements of many tickers in one call
+
+    statements come from one read of the statement store (latest filing wins
+    for restated years), are stacked into one matrix and projected at each
+    company's last revenue growth rate with a single broadcasted operation.
+    returns a frame indexed by (ticker, account, occurrence) with a column
+    per year. tickers without stored statements or revenue are left out.
+    with workers > 1 the universe is split over a process pool"""
+
+    tickers = [ticker.upper() for ticker in tickers]
+
+    workers = min(workers, len(tickers))
+
+    if workers > 1:
+        chunks = [tickers[i::workers] for i in range(workers)]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            frames = list(executor.map(_forecast_chunk, chunks, [periods] * workers,
+                                       [root] * workers, [form] * workers))
+
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame()
+
+        df = pd.concat(frames)
+
+        return df.reindex(columns=sorted(df.columns)).sort_index(level='ticker', sort_remaining=False)
+
+    store = statement_store() if root is None else StatementStore(root)
+    panel = store.panel(tickers=tickers, statements=['income'], form=form)
+    if panel.empty:
+        return pd.DataFrame()
+
+    return _forecast_panel(pivot_panel(panel, 'income'), periods)
@@ -0,0 +1,80 @@
+"""import time report for the modules workers and scripts import
+
+runs `python -X importtime -c "import <module>"` in a fresh interpreter,
+prints the total and the slowest imports by cumulative time, and lists any
+of the deferred dependencies that were imported anyway. exits with 1 if the
+total is over --max-ms or a deferred dependency was imported, so it can be
+used to catch regressions
+
+    python import_benchmark.py statements --top 15 --max-ms 800
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+
+# only imported by the features that need them
+DEFERRED = ['pandas_datareader', 'fredapi', 'sqlalchemy', 'sqlalchemy_utils',
+            'requests', 'tqdm', 'openpyxl', 'ratelimit']
+
+
+def import_times(module):
+    """{imported module: (self us, cumulative us)} for importing module in a
+    fresh interpreter, and the deferred dependencies it imported"""
+
+    code = (f'import sys; import {module}; '
+            f'print(",".join(m for m in {DEFERRED!r} if m in sys.modules))')
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own), int(cumulative))
+
+    imported = [name for name in result.stdout.strip().split(',') if name]
+
+    return times, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=['statements', 'data_ops', 'forecast'])
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        times, imported = import_times(module)
+        total = times[module][1] / 1000
+
+        print(f'{module}: {total:.1f} ms')
+        slowest = sorted((item for item in times.items() if item[0] != module),
+                         key=lambda item: -item[1][1])
+        for name, (own, cumulative) in slowest[:args.top]:
+            print(f'    {cumulative / 1000:8.1f} ms  {own / 1000:8.1f} ms  {name}')
+
+        if imported:
+            print(f'    deferred dependencies imported: {", ".join(imported)}')
+            failed = True
+
+        if args.max_ms is not None and total > args.max_ms:
+            print(f'    over the {args.max_ms:.0f} ms budget')
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
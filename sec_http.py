@@ -0,0 +1,78 @@
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from data_ops import SEC_HEADERS, sec_rate_limiter
+
+
+class _LimitedRetry(Retry):
+    """Retry that takes a token from rate_limiter before every resend, so
+    retries (e.g. after a 429) stay within the shared budget"""
+
+    def __init__(self, *args, rate_limiter=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.rate_limiter = self.rate_limiter
+
+        return retry
+
+
+    def sleep(self, response=None):
+        super().sleep(response)
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+
+
+class SECSession(requests.Session):
+    """keep-alive session for SEC requests with a pooled, retrying adapter and
+    a default timeout. paths starting with '/' are resolved against base_url,
+    so the same code can be pointed at a local stand-in server. every request
+    sent, including redirects and retries, first takes a token from
+    rate_limiter (the shared SEC limiter by default). safe to share between
+    threads"""
+
+    def __init__(self, base_url=None, pool_size=10, retries=3, backoff=0.5,
+                 timeout=30, headers=None, rate_limiter=None):
+        super().__init__()
+
+        if rate_limiter is None:
+            rate_limiter = sec_rate_limiter()
+
+        self.rate_limiter = rate_limiter
+
+        if base_url is None:
+            base_url = os.environ.get('SEC_BASE_URL', 'https://www.sec.gov')
+
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+        retry = _LimitedRetry(total=retries, backoff_factor=backoff,
+                              status_forcelist=(429, 500, 502, 503, 504),
+                              allowed_methods=('GET', 'HEAD'), rate_limiter=rate_limiter)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+        self.headers.update(SEC_HEADERS if headers is None else headers)
+
+
+    def request(self, method, url, **kwargs):
+        if url.startswith('/'):
+            url = ''.join([self.base_url, url])
+
+        kwargs.setdefault('timeout', self.timeout)
+
+        return super().request(method, url, **kwargs)
+
+
+    def send(self, request, **kwargs):
+        # redirects are sent from here without going through request()
+        self.rate_limiter.acquire()
+
+        return super().send(request, **kwargs)
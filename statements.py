@@ -1,37 +1,284 @@
 import datetime as dt
-import os
+from functools import cached_property
+from typing import NamedTuple
 import numpy as np
 import pandas as pd
-import pandas_datareader as pdr
 from dateutil.relativedelta import relativedelta
-from fredapi import Fred
-from data_ops import DataSQL
+from data_ops import DataSQL, fred_store, gather, price_store, ticker_index
+from forecast import (REVENUE_ACCOUNTS, forecast_columns, forecast_frame,
+                      sensitivity_grid, simulate_frame)
+
+
+def log_returns(prices):
+    return np.log(prices / prices.shift())
+
+
+def betas(returns, benchmarks, shrinkage=None, min_periods=12):
+    """betas of many tickers from one frame of log returns (dates x symbols)
+
+    benchmarks maps each ticker to the column of its benchmark. each beta
+    uses the dates where both the ticker and its benchmark have a return,
+    all of them come out of one set of masked column sums. tickers with fewer
+    than min_periods such dates get NaN
+
+    shrinkage=None keeps the sample betas, a float w pulls every beta towards
+    1 as w + (1 - w) * beta (blume), 'vasicek' weighs each beta against the
+    cross-sectional mean of the betas sharing its benchmark by their
+    standard errors (of all betas when the benchmark has only one)"""
+
+    tickers = list(benchmarks)
+    stock = returns[tickers].to_numpy(dtype=np.float64)
+    market = returns[[benchmarks[ticker] for ticker in tickers]].to_numpy(dtype=np.float64)
+
+    mask = ~np.isnan(stock) & ~np.isnan(market)
+    n = mask.sum(axis=0).astype(np.float64)
+    r = np.where(mask, stock, 0.0)
+    m = np.where(mask, market, 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sum_r = r.sum(axis=0)
+        sum_m = m.sum(axis=0)
+        srm = (r * m).sum(axis=0) - sum_r * sum_m / n
+        smm = (m * m).sum(axis=0) - sum_m ** 2 / n
+        srr = (r * r).sum(axis=0) - sum_r ** 2 / n
+
+        raw = srm / smm
+        raw[n < max(min_periods, 3)] = np.nan
+
+        # squared standard error of each beta from the regression residuals
+        se2 = (srr - raw * srm) / (n - 2) / smm
+
+    df = pd.DataFrame({'benchmark': [benchmarks[ticker] for ticker in tickers],
+                       'raw_beta': raw, 'se2': se2, 'observations': n.astype(int)},
+                      index=pd.Index(tickers, name='ticker'))
+
+    if shrinkage is None:
+        df['beta'] = df['raw_beta']
+
+    elif shrinkage == 'vasicek':
+        grouped = df.groupby('benchmark')['raw_beta']
+        prior_mean = grouped.transform('mean')
+        prior_var = grouped.transform('var')
+
+        # benchmarks with a single ticker (or identical betas) have no spread
+        # to shrink towards, they use the whole cross-section instead
+        pooled = ~(prior_var > 0)
+        prior_mean = prior_mean.mask(pooled, df['raw_beta'].mean())
+        prior_var = prior_var.mask(pooled, df['raw_beta'].var())
+
+        beta = (prior_var * df['raw_beta'] + df['se2'] * prior_mean) / (prior_var + df['se2'])
+
+        # and keep their sample beta when the cross-section has no spread either
+        df['beta'] = beta.where(prior_var > 0, df['raw_beta'])
+
+    else:
+        df['beta'] = shrinkage + (1 - shrinkage) * df['raw_beta']
+
+    return df[['benchmark', 'beta', 'raw_beta', 'observations']]
+
+
+def universe_returns(tickers, start=5, end=None, interval='m', store=None):
+    """one aligned log return matrix (dates x symbols) for tickers and their
+    exchange indexes from company_tickers.json, and the {ticker: benchmark}
+    map. start is in years before end (now by default), tickers without an
+    exchange are left out"""
+
+    if end is None:
+        end = dt.datetime.now()
+    start = end - relativedelta(years=start)
+
+    benchmarks = {ticker: info['exchange'] for ticker, info in ticker_index().bulk(tickers).items()
+                  if info is not None and info.get('exchange')}
+
+    symbols = list(dict.fromkeys([*benchmarks, *benchmarks.values()]))
+
+    store = price_store() if store is None else store
+    prices = store.get(symbols, start, end, interval=interval)
+
+    return log_returns(prices), benchmarks
+
+
+def universe_betas(tickers, start=5, end=None, interval='m', shrinkage=None,
+                   min_periods=12, store=None):
+    """betas of a ticker universe against their exchange indexes from one
+    aligned return matrix, see universe_returns and betas"""
+
+    returns, benchmarks = universe_returns(tickers, start, end, interval, store)
+
+    return betas(returns, benchmarks, shrinkage=shrinkage, min_periods=min_periods)
+
+
+def _window_sums(values, window):
+    """sums over the trailing window at every date (all dates so far when
+    window is None) from one cumulative sum"""
+
+    sums = np.cumsum(values, axis=0)
+    if window is None:
+        return sums
+
+    lagged = np.zeros_like(sums)
+    lagged[window:] = sums[:-window]
+
+    return sums - lagged
+
+
+def rolling_betas(returns, benchmarks, window=36, min_periods=12):
+    """beta of every ticker against its benchmark through time, over a
+    trailing window of `window` dates or expanding from the first date when
+    window is None. every window comes from differences of cumulative sums,
+    so the cost is linear in the number of dates whatever the window. dates
+    with fewer than min_periods returns for the pair are NaN. returns a
+    date x ticker frame"""
+
+    tickers = list(benchmarks)
+    stock = returns[tickers].to_numpy(dtype=np.float64)
+    market = returns[[benchmarks[ticker] for ticker in tickers]].to_numpy(dtype=np.float64)
+
+    mask = ~np.isnan(stock) & ~np.isnan(market)
+    r = np.where(mask, stock, 0.0)
+    m = np.where(mask, market, 0.0)
+
+    n = _window_sums(mask.astype(np.float64), window)
+    sum_r = _window_sums(r, window)
+    sum_m = _window_sums(m, window)
+    sum_rm = _window_sums(r * m, window)
+    sum_mm = _window_sums(m * m, window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = (sum_rm - sum_r * sum_m / n) / (sum_mm - sum_m ** 2 / n)
+
+    beta[n < max(min_periods, 3)] = np.nan
+
+    return pd.DataFrame(beta, index=returns.index, columns=tickers)
+
+
+def rolling_capm(returns, benchmarks, risk_free, window=36, min_periods=12):
+    """CAPM cost of equity of every ticker through time, with the same
+    formula as CAPM.capm: the market rate is the mean benchmark log return
+    over the window, risk_free a number or a date indexed series (carried
+    forward to the return dates). returns a date x ticker frame"""
+
+    beta = rolling_betas(returns, benchmarks, window=window, min_periods=min_periods)
+
+    market = returns[list(dict.fromkeys(benchmarks.values()))]
+    valid = market.notna().to_numpy()
+
+    count = _window_sums(valid.astype(np.float64), window)
+    total = _window_sums(np.where(valid, market.to_numpy(dtype=np.float64), 0.0), window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        market_rate = pd.DataFrame(total / count, index=market.index, columns=market.columns)
+
+    market_rate = market_rate[[benchmarks[ticker] for ticker in beta.columns]]
+    market_rate.columns = beta.columns
+
+    if isinstance(risk_free, pd.Series):
+        risk_free = risk_free.sort_index().reindex(returns.index, method='ffill')
+        risk_premium = market_rate.sub(risk_free, axis=0)
+    else:
+        risk_premium = market_rate - risk_free
+
+    return risk_premium + beta * risk_premium
+
+
+def inflation_rate(cpi, base_year='1983-08-01'):
+    """CPI change from base_year to the latest month"""
+
+    df = pd.DataFrame(cpi)
+
+    return (df.iloc[-1] - df.loc[base_year]) / df.loc[base_year]
+
+
+def risk_free_rate(tbills, cpi, base_year='1983-08-01'):
+    df = pd.DataFrame(tbills)
+
+    return 1 + df.iloc[-1] / 1 + inflation_rate(cpi, base_year)
+
+
+def market_rate(prices):
+    """mean log return of an index's prices"""
+
+    return np.nanmean(pd.DataFrame(log_returns(prices)).to_numpy())
+
+
+class CAPMEstimate(NamedTuple):
+    capm: float
+    beta: float
+    market_rate: float
+    risk_free_rate: float
+    timings: dict
 
 
 class IncomeStatement(DataSQL):
+    """income statements of a ticker. the formatted statement, its column
+    layout and the revenue growth rates are computed once and cached until
+    the statements are reloaded or replaced"""
+
+    cached_views = ('formatted', 'columns', 'revenue', 'growth_rates')
+
     def __init__(self, ticker):
         super().__init__(ticker)
-        self.income_statements = self.load_income_statements()
+
+
+    @property
+    def income_statements(self):
+        """loaded (or downloaded) on first use"""
+
+        if '_income_statements' not in self.__dict__:
+            self._income_statements = self.load_income_statements()
+
+        return self._income_statements
+
+
+    @income_statements.setter
+    def income_statements(self, statements):
+        self._income_statements = statements
+        self.invalidate()
+
+
+    def invalidate(self):
+        """drops the cached views, they are rebuilt on next use"""
+
+        for name in self.cached_views:
+            self.__dict__.pop(name, None)
+
+
+    def reload(self, form='10-K'):
+        self.income_statements = self.load_income_statements(form=form)
 
 
     def union(self, statements):
-        copies = [df.copy() for df in statements]
-        cols = []
-        for i in copies:
-            for j in i.columns:
-                cols.append(i.pop(j))
+        """joins yearly statements into one frame, matching rows on account
+        (repeated labels by their order). every filing reports earlier years
+        again, for a year reported by several filings the latest filing's
+        figures win, so restatements replace the original numbers"""
 
-        df = pd.DataFrame()
+        def latest(df):
+            return max((int(column) for column in df.columns if str(column).isdigit()),
+                       default=0)
 
-        for i in cols:
-            if i.name not in df.columns:
-                df[i.name] = i
+        keyed = []
+        for df in sorted(statements, key=latest, reverse=True):
+            accounts = df['Accounts'].fillna('')
+            key = pd.MultiIndex.from_arrays([accounts, accounts.groupby(accounts).cumcount()])
+            keyed.append(df.drop(columns='Accounts').set_axis(key, axis=0))
 
-        return df
+        if not keyed:
+            return pd.DataFrame()
 
+        df = pd.concat(keyed, axis=1)
+        df = df.loc[:, ~df.columns.duplicated()]
+
+        accounts = df.index.get_level_values(0).to_series().replace('', np.nan)
+
+        df = df.reset_index(drop=True)
+        df.insert(0, 'Accounts', accounts.to_numpy())
+
+        return df
 
-    def formatted_income_statement(self):
 
+    @cached_property
+    def formatted(self):
         formatted = self.union(self.income_statements)
 
         try:
@@ -45,120 +292,136 @@ class IncomeStatement(DataSQL):
         return formatted
 
 
-    def add_columns(self, periods=5):
-        df = self.formatted_income_statement().copy()
-
-        year = int(df.columns[-1])
-        first_period = year + 1
-        last_period = first_period + periods
-
-        new_cols = list(range(first_period, last_period))
-        unpacked = [*list(df.columns), *new_cols]
-
-        return unpacked
+    @cached_property
+    def columns(self):
+        return list(self.formatted.columns)
 
 
-    def revenue_growth_rate(self):
-        rev_accts = ['Net sales', 'Revenue']
+    @cached_property
+    def revenue(self):
+        rev_accts = REVENUE_ACCOUNTS
+        series = None
         for i in rev_accts:
             try:
-                series = self.formatted_income_statement().loc[i]
-            except Exception:
+                series = self.formatted.loc[i]
+            except KeyError:
                 continue
 
-        numeric = pd.to_numeric(series).rename('Growth rate')
-        growth_rate = \
-        pd.DataFrame(numeric).pct_change(periods=1).swapaxes('index',
-                                                             'columns').iloc[0][
-            -1]
-
-        return growth_rate
+        if series is None:
+            raise KeyError(f'no revenue account ({", ".join(rev_accts)}) '
+                           f'in {self.ticker} income statements')
 
+        return pd.to_numeric(series).rename('Revenue')
 
-    def forecast_accounts(self, df, periods=5):
-        growth_rate = self.revenue_growth_rate()
-        factor = (1 + growth_rate)
 
-        df = df.copy()
+    @cached_property
+    def growth_rates(self):
+        return self.revenue.pct_change(periods=1).rename('Growth rate')
 
-        new_df = pd.DataFrame(columns=self.add_columns())
 
-        i = 1
-        while i < len(df.index):
-            row_name = df.iloc[i].name
-            j = 1
-            arrays = []
-            array = df.iloc[i].to_numpy(dtype=np.float64)
+    def formatted_income_statement(self):
+        return self.formatted.copy()
 
-            while j < periods + 1:
 
-                if j == 1:
-                    array = np.append(array,
-                                      np.ceil(np.nanprod(array[-1]) * factor))
-                    arrays.append(array)
+    def add_columns(self, periods=5):
+        return forecast_columns(self.columns, periods)
 
-                else:
-                    array = np.append(array, np.ceil(
-                        np.nanprod(arrays[-1][-1]) * factor))
-                    arrays.append(array)
 
-                j += 1
+    def revenue_growth_rate(self):
+        return self.growth_rates.iloc[-1]
 
-            series = pd.Series(arrays[-1]).rename(row_name)
-            temporary_df = pd.DataFrame(series).swapaxes('index', 'columns')
-            temporary_df.columns = self.add_columns()
 
-            new_df.loc[row_name] = temporary_df.iloc[0]
+    def forecast_accounts(self, df, periods=5, growth=None):
+        """projects every account `periods` years ahead, by default all at the
+        last revenue growth rate. growth may also be a Series of rates per
+        account"""
 
-            i += 1
+        if growth is None:
+            growth = self.revenue_growth_rate()
 
-        return new_df
+        return forecast_frame(df, growth, periods=periods)
 
 
     def forecasted_income_statement(self):
-        return self.forecast_accounts(self.formatted_income_statement())
+        return self.forecast_accounts(self.formatted)
+
+
+    def simulated_income_statement(self, periods=5, paths=10000,
+                                   percentiles=(5, 50, 95), seed=None):
+        """percentile bands of the forecast over `paths` simulated growth
+        paths, centred on the last revenue growth rate with the volatility of
+        the historical growth rates"""
+
+        growth_std = self.growth_rates.std()
+        if np.isnan(growth_std):
+            growth_std = 0.0
+
+        return simulate_frame(self.formatted, self.revenue_growth_rate(), growth_std,
+                              periods=periods, paths=paths,
+                              percentiles=percentiles, seed=seed)
+
+
+    def growth_sensitivity(self, growth_rates, horizons=(1, 2, 3, 4, 5)):
+        return sensitivity_grid(self.formatted, growth_rates, horizons)
 
 
 class Risk(DataSQL):
 
-    def __init__(self, ticker, api_key=os.environ['API_KEY']):
+    def __init__(self, ticker, api_key=None):
+        """api_key defaults to the API_KEY environment variable, read when
+        FRED is first used"""
+
         super().__init__(ticker)
-        self.exchange = self.get_exchange_json()
-        self.fred = Fred(api_key=api_key)
+        self.api_key = api_key
+
+
+    @cached_property
+    def exchange(self):
+        return self.get_exchange_json()
+
+
+    @cached_property
+    def fred(self):
+        return fred_store(api_key=self.api_key)
 
 
     def get_inflation_rate(self, base_year='1983-08-01'):
         cpi = self.fred.get_series('CPIAUCSL')
-        df = pd.DataFrame(cpi)
 
-        rate = (df.iloc[-1] - df.loc[base_year]) / df.loc[base_year]
-
-        return rate
+        return inflation_rate(cpi, base_year)
 
 
     def get_risk_free_rate(self):
         tbills = self.fred.get_series('TB3MS')
-        inflation_rate = self.get_inflation_rate()
+        cpi = self.fred.get_series('CPIAUCSL')
+
+        return risk_free_rate(tbills, cpi)
+
+
+    def risk_free_rates(self, base_year='1983-08-01'):
+        """get_risk_free_rate at every month of the FRED series"""
+
+        cpi = self.fred.get_series('CPIAUCSL')
+        tbills = self.fred.get_series('TB3MS')
 
-        df = pd.DataFrame(tbills)
+        inflation_rates = (cpi - cpi.loc[base_year]) / cpi.loc[base_year]
 
-        rate = 1 + df.iloc[-1] / 1 + inflation_rate
+        return (1 + tbills / 1 + inflation_rates).dropna()
 
-        return rate
 
-    def get_market_rate(self, start=5, end=dt.datetime.now(), interval='m'):
-        start = dt.datetime.now() - relativedelta(years=start)
+    def _window(self, start, end):
+        if end is None:
+            end = dt.datetime.now()
 
-        data = pdr.get_data_yahoo(self.exchange, start, end, interval=interval)
-        data = data['Adj Close']
+        return end - relativedelta(years=start), end
 
-        log_returns = np.log(data / data.shift())
 
-        array = pd.DataFrame(log_returns).to_numpy()
+    def get_market_rate(self, start=5, end=None, interval='m'):
+        start, end = self._window(start, end)
 
-        rate = np.nanmean(array)
+        data = price_store().get(self.exchange, start, end, interval=interval)
 
-        return rate
+        return market_rate(data)
 
 
 class CAPM(Risk):
@@ -167,33 +430,71 @@ class CAPM(Risk):
     def __init__(self, ticker):
         super().__init__(ticker)
 
-    def beta(self, start=5, end=dt.datetime.now(), interval='m'):
+    def beta(self, start=5, end=None, interval='m'):
         tickers = [self.ticker, self.exchange]
 
-        start = dt.datetime.now() - relativedelta(years=start)
+        start, end = self._window(start, end)
 
-        data = pdr.get_data_yahoo(tickers, start, end, interval=interval)
-        data = data['Adj Close']
+        data = price_store().get(tickers, start, end, interval=interval)
 
-        log_returns = np.log(data / data.shift())
+        return self._beta(data)
 
-        # get covariance and variance
-        cov = log_returns.cov()
-        var = log_returns[self.exchange].var()
 
-        # get beta
-        beta = cov.loc[self.ticker, self.exchange] / var
+    def _beta(self, prices):
+        beta = betas(log_returns(prices), {self.ticker: self.exchange}, min_periods=3)
 
-        return beta
+        return beta.loc[self.ticker, 'beta']
 
 
-    def capm(self):
-        beta = self.beta()
-        market_rate = self.get_market_rate()
-        risk_free_rate = self.get_risk_free_rate()
+    def rolling_beta(self, window=36, start=10, end=None, interval='m'):
+        """beta through time over a trailing window of `window` periods, or
+        expanding when window is None"""
+
+        returns, benchmarks = universe_returns([self.ticker], start, end, interval)
 
-        risk_premium = market_rate - risk_free_rate
+        return rolling_betas(returns, benchmarks, window=window)[self.ticker]
+
+
+    def rolling_capm(self, window=36, start=10, end=None, interval='m'):
+        """capm through time, see rolling_capm"""
+
+        returns, benchmarks = universe_returns([self.ticker], start, end, interval)
+
+        return rolling_capm(returns, benchmarks, self.risk_free_rates(),
+                            window=window)[self.ticker]
+
+
+    def capm_inputs(self, start=5, end=None, interval='m'):
+        """fetches the prices and FRED series capm needs concurrently, the
+        beta and market rate share one price request. returns
+        ({input: data}, {input: seconds})"""
+
+        start, end = self._window(start, end)
+        prices = (price_store().get, (self.ticker, self.exchange), start, end, interval)
+
+        return gather({
+            'beta': prices,
+            'market_rate': prices,
+            'tbills': (self.fred.get_series, 'TB3MS'),
+            'cpi': (self.fred.get_series, 'CPIAUCSL'),
+        })
+
+
+    def estimate(self, start=5, end=None, interval='m'):
+        """capm with its inputs and how long each input took to fetch"""
+
+        data, timings = self.capm_inputs(start, end, interval)
+
+        beta = self._beta(data['beta'])
+        market = market_rate(data['market_rate'][self.exchange])
+        risk_free = risk_free_rate(data['tbills'], data['cpi'])
+
+        risk_premium = market - risk_free
 
         capm = risk_premium + (beta * risk_premium)
 
-        return capm
+        return CAPMEstimate(capm, beta, market, risk_free, timings)
+
+
+    def capm(self):
+        return self.estimate().capm